@@ -0,0 +1,202 @@
+"""Admission control for warehouse queries.
+
+Queries wait in one queue shared by every session. A query is admitted when
+fewer than ``max_running`` queries are running overall and its session has
+fewer than ``max_per_session`` running. Among waiting queries the one with
+the lowest planner cost goes first, so a quick lookup does not sit behind a
+heavy join. A waiting query's effective cost halves every ``aging_s`` seconds
+so expensive queries are not starved.
+
+``ConnectionPool`` gives each admitted query its own connection: psycopg2
+serializes queries on a shared connection, which would let only one
+admitted query run at a time.
+"""
+import itertools
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+import psycopg2
+
+ADMISSION_MAX_RUNNING = int(os.getenv("ADMISSION_MAX_RUNNING", "4"))
+ADMISSION_MAX_PER_SESSION = int(os.getenv("ADMISSION_MAX_PER_SESSION", "2"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "50"))
+ADMISSION_MAX_WAIT_S = float(os.getenv("ADMISSION_MAX_WAIT_S", "60"))
+ADMISSION_AGING_S = float(os.getenv("ADMISSION_AGING_S", "10"))
+# Queue priority for statements EXPLAIN does not accept (e.g. SHOW).
+ADMISSION_DEFAULT_COST = float(os.getenv("ADMISSION_DEFAULT_COST", "1000"))
+# How often a waiting caller's ``on_wait`` is refreshed.
+WAIT_POLL_S = 0.25
+
+
+class QueueFull(Exception):
+    """Raised when the admission queue is already at its limit."""
+
+
+class AdmissionTimeout(Exception):
+    """Raised when a query waited longer than ``max_wait_s`` to be admitted."""
+
+
+def estimate_cost(conn, sql):
+    """Planner total cost of ``sql`` from ``EXPLAIN`` (nothing is executed)."""
+    with conn.cursor() as cur:
+        cur.execute("EXPLAIN (FORMAT JSON) " + sql)
+        plan = cur.fetchone()[0]
+    return float(plan[0]["Plan"]["Total Cost"])
+
+
+class ConnectionPool:
+    """At most ``size`` autocommit connections; callers wait for a free one.
+
+    Connections are opened on first use and kept open between callers.
+    psycopg2's own pools close every connection returned beyond ``minconn``,
+    and a non-zero ``minconn`` connects eagerly, so neither fits here.
+    """
+
+    def __init__(self, db_url, size, readonly=False):
+        self.db_url = db_url
+        self.size = size
+        self.readonly = readonly
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._idle = []
+        self._generation = 0
+
+    def _getconn(self):
+        stale = []
+        with self._lock:
+            generation = self._generation
+            while self._idle:
+                conn, born = self._idle.pop()
+                if born == generation and not conn.closed:
+                    break
+                stale.append(conn)
+            else:
+                conn = None
+        for old in stale:
+            old.close()
+        if conn is None:
+            conn = psycopg2.connect(self.db_url)
+            conn.set_session(autocommit=True, readonly=self.readonly)
+        return conn, generation
+
+    @contextmanager
+    def connection(self):
+        with self._slots:
+            conn, born = self._getconn()
+            try:
+                yield conn
+            finally:
+                with self._lock:
+                    keep = not conn.closed and born == self._generation
+                    if keep:
+                        self._idle.append((conn, born))
+                if not keep:
+                    conn.close()
+
+    def retire(self):
+        """Replace every current connection, e.g. after the server went away.
+
+        Connections in use are closed when they are returned and idle ones
+        when they are next reached, so no caller loses one mid-query.
+        """
+        with self._lock:
+            self._generation += 1
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            conn.close()
+
+
+class _Ticket:
+    def __init__(self, session_id, cost, seq):
+        self.session_id = session_id
+        self.cost = cost
+        self.seq = seq
+        self.queued_at = time.monotonic()
+
+    def priority(self, now, aging_s):
+        return (self.cost / 2 ** ((now - self.queued_at) / aging_s), self.seq)
+
+
+class AdmissionController:
+    def __init__(
+        self,
+        max_running=ADMISSION_MAX_RUNNING,
+        max_per_session=ADMISSION_MAX_PER_SESSION,
+        max_queue=ADMISSION_MAX_QUEUE,
+        max_wait_s=ADMISSION_MAX_WAIT_S,
+        aging_s=ADMISSION_AGING_S,
+    ):
+        self.max_running = max_running
+        self.max_per_session = max_per_session
+        self.max_queue = max_queue
+        self.max_wait_s = max_wait_s
+        self.aging_s = aging_s
+        self._running = Counter()
+        self._waiting = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+
+    def _runnable_order(self, now):
+        """Waiting tickets whose session may start another query, best first."""
+        ready = [t for t in self._waiting if self._running[t.session_id] < self.max_per_session]
+        return sorted(ready, key=lambda t: t.priority(now, self.aging_s))
+
+    def _position(self, ticket, now):
+        """0 when ``ticket`` is next; otherwise how many queries go before it.
+
+        A ticket whose session is at its limit goes after every runnable one.
+        """
+        order = self._runnable_order(now)
+        return order.index(ticket) if ticket in order else len(order) + 1
+
+    @contextmanager
+    def admit(self, session_id, cost, on_wait=None):
+        """Hold a running slot for the body of the ``with`` block.
+
+        ``on_wait(position, waited_s)`` is called from the caller's thread
+        while the query is queued. Raises ``QueueFull`` or ``AdmissionTimeout``.
+        """
+        with self._cond:
+            if len(self._waiting) >= self.max_queue:
+                raise QueueFull(f"{len(self._waiting)} queries already waiting")
+            ticket = _Ticket(session_id, cost, next(self._seq))
+            self._waiting.append(ticket)
+        try:
+            while True:
+                with self._cond:
+                    now = time.monotonic()
+                    position = self._position(ticket, now)
+                    if position == 0 and sum(self._running.values()) < self.max_running:
+                        self._waiting.remove(ticket)
+                        self._running[session_id] += 1
+                        break
+                    waited_s = now - ticket.queued_at
+                    if waited_s > self.max_wait_s:
+                        raise AdmissionTimeout(f"waited {waited_s:.1f}s for a query slot")
+                    self._cond.wait(WAIT_POLL_S)
+                if on_wait is not None:
+                    on_wait(position, waited_s)
+        except BaseException:
+            with self._cond:
+                if ticket in self._waiting:
+                    self._waiting.remove(ticket)
+                self._cond.notify_all()
+            raise
+        try:
+            yield time.monotonic() - ticket.queued_at
+        finally:
+            with self._cond:
+                self._running[session_id] -= 1
+                if not self._running[session_id]:
+                    del self._running[session_id]
+                self._cond.notify_all()
+
+    def snapshot(self):
+        with self._cond:
+            return {"running": sum(self._running.values()), "waiting": len(self._waiting)}
@@ -0,0 +1,147 @@
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+
+LOGIN_WORKERS = int(os.getenv("LOGIN_WORKERS", "2"))
+LOGIN_QUEUE_LIMIT = int(os.getenv("LOGIN_QUEUE_LIMIT", "8"))
+LOGIN_TIMEOUT_S = float(os.getenv("LOGIN_TIMEOUT_S", "10"))
+LOGIN_MAX_FAILURES = int(os.getenv("LOGIN_MAX_FAILURES", "5"))
+LOGIN_WINDOW_S = float(os.getenv("LOGIN_WINDOW_S", "300"))
+SESSION_TTL_S = int(os.getenv("SESSION_TTL_S", str(12 * 3600)))
+
+
+class LoginBusy(Exception):
+    """Raised when every verification slot is taken."""
+
+
+class PasswordVerifier:
+    """Run bcrypt checks on a small dedicated pool.
+
+    bcrypt releases the GIL while hashing, so verification on the pool does
+    not stall other sessions' script threads. At most ``workers`` hashes run
+    at once and at most ``queue_limit`` more may wait; anything beyond that
+    is refused with ``LoginBusy`` instead of queueing more CPU work.
+    """
+
+    def __init__(self, workers=LOGIN_WORKERS, queue_limit=LOGIN_QUEUE_LIMIT):
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self._slots = threading.BoundedSemaphore(workers + queue_limit)
+
+    def verify(self, password, hashed, timeout=LOGIN_TIMEOUT_S):
+        if not self._slots.acquire(blocking=False):
+            raise LoginBusy("Too many sign-ins in progress")
+        try:
+            future = self._pool.submit(bcrypt.checkpw, password, hashed)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future.result(timeout=timeout)
+
+
+class AttemptLimiter:
+    """Sliding-window limit on failed attempts per client key (e.g. IP)."""
+
+    def __init__(self, max_failures=LOGIN_MAX_FAILURES, window_s=LOGIN_WINDOW_S):
+        self.max_failures = max_failures
+        self.window_s = window_s
+        self._failures = defaultdict(deque)
+        self._lock = threading.Lock()
+
+    def _prune(self, key, now):
+        failures = self._failures[key]
+        while failures and now - failures[0] > self.window_s:
+            failures.popleft()
+        if not failures:
+            del self._failures[key]
+        return failures
+
+    def retry_after(self, key, now=None):
+        """Seconds until ``key`` may try again; 0 when allowed."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            failures = self._prune(key, now)
+            if len(failures) < self.max_failures:
+                return 0.0
+            return self.window_s - (now - failures[0])
+
+    def record_failure(self, key, now=None):
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self._failures[key].append(now)
+
+    def reset(self, key):
+        with self._lock:
+            self._failures.pop(key, None)
+
+
+class RevokedTokens:
+    """Session tokens ended by Logout before their expiry.
+
+    Kept in memory until each token would have expired anyway. A restart
+    forgets them; rotate ``SESSION_SECRET`` to end every session.
+    """
+
+    def __init__(self):
+        self._expiry = {}
+        self._lock = threading.Lock()
+
+    def revoke(self, token):
+        try:
+            expires = int(token.split(".")[0])
+        except (AttributeError, ValueError):
+            return
+        with self._lock:
+            now = time.time()
+            for old in [t for t, at in self._expiry.items() if at < now]:
+                del self._expiry[old]
+            self._expiry[token] = expires
+
+    def __contains__(self, token):
+        with self._lock:
+            return token in self._expiry
+
+
+def secrets_match(supplied, expected):
+    """Constant-time string comparison that is safe for any user input.
+
+    ``hmac.compare_digest`` raises TypeError on non-ASCII ``str``, so both
+    sides are compared as UTF-8 bytes.
+    """
+    return hmac.compare_digest(supplied.encode("utf-8"), expected.encode("utf-8"))
+
+
+def _sign(secret, payload):
+    return hmac.new(secret, payload.encode("utf-8"), hashlib.sha256).hexdigest()
+
+
+def issue_session_token(secret, ttl_s=SESSION_TTL_S):
+    """Return an HMAC-signed token of the form ``<expiry>.<nonce>.<signature>``."""
+    payload = f"{int(time.time()) + ttl_s}.{secrets.token_hex(8)}"
+    return f"{payload}.{_sign(secret, payload)}"
+
+
+def verify_session_token(token, secret, revoked=None):
+    """Check the signature and expiry of a token from ``issue_session_token``.
+
+    Tokens in ``revoked`` (a ``RevokedTokens``) are refused.
+    """
+    try:
+        expires_text, nonce, signature = token.split(".")
+        expires = int(expires_text)
+    except (AttributeError, ValueError):
+        return False
+    if expires < time.time():
+        return False
+    # Sign the text as given: int() also accepts "+123" or "0123", which
+    # would let a revoked token back in under another spelling.
+    if not secrets_match(signature, _sign(secret, f"{expires_text}.{nonce}")):
+        return False
+    return revoked is None or token not in revoked
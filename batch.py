@@ -0,0 +1,330 @@
+"""Run a file of natural-language questions through SQL generation and execution.
+
+Questions are generated concurrently under a requests-per-minute budget, each
+generated query is checked (single read-only statement, then ``EXPLAIN``) and
+run on a bounded connection pool, and everything lands in one report plus a
+CSV per question::
+
+    python batch.py weekly_questions.txt --out reports/2024-w12
+"""
+import argparse
+import io
+import json
+import os
+import random
+import re
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+import openai
+import pandas as pd
+from psycopg2.pool import ThreadedConnectionPool
+
+from admission import estimate_cost
+from replicas import is_read_only
+from sql_generation import ensure_limit, generate_sql
+from utils import get_db_url
+
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))
+BATCH_DB_WORKERS = int(os.getenv("BATCH_DB_WORKERS", "4"))
+BATCH_RPM = int(os.getenv("BATCH_RPM", "60"))
+BATCH_ROW_LIMIT = int(os.getenv("BATCH_ROW_LIMIT", "10000"))
+BATCH_MAX_RETRIES = 5
+BATCH_STATEMENT_TIMEOUT = "60s"
+BATCH_LOCK_TIMEOUT = "3s"
+CONNECT_TIMEOUT = 5
+
+
+def read_questions(text):
+    """One question per line; blank lines and ``#`` comments are skipped."""
+    questions = []
+    for line in text.splitlines():
+        line = line.strip()
+        if line and not line.startswith("#"):
+            questions.append(line)
+    return questions
+
+
+class RateLimiter:
+    """Token bucket allowing ``rpm`` acquisitions a minute, shared by all threads."""
+
+    def __init__(self, rpm, burst=None):
+        self.rate = rpm / 60.0
+        self.capacity = burst or max(1, rpm // 10)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """Hold every caller back for ``seconds`` after the API pushes back."""
+        with self._lock:
+            self._refill()
+            self.tokens = min(self.tokens, -seconds * self.rate)
+
+
+def _retry_after(error, attempt):
+    """Seconds to wait before retrying, from the response headers if present."""
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        if "retry-after-ms" in headers:
+            return float(headers["retry-after-ms"]) / 1000
+        if "retry-after" in headers:
+            return float(headers["retry-after"])
+    except ValueError:
+        pass
+    return min(30.0, 2 ** attempt) * random.uniform(0.5, 1.0)
+
+
+def generate_with_retry(client, question, limiter, retries=BATCH_MAX_RETRIES):
+    """Generate SQL for ``question``, backing off on rate-limit and server errors."""
+    for attempt in range(retries + 1):
+        limiter.acquire()
+        try:
+            return generate_sql(client, question)
+        except (openai.RateLimitError, openai.InternalServerError, openai.APITimeoutError) as e:
+            if attempt == retries:
+                raise
+            delay = _retry_after(e, attempt)
+            if isinstance(e, openai.RateLimitError):
+                limiter.pause(delay)
+            time.sleep(delay)
+
+
+def validate(conn, sql):
+    """Return an error message if ``sql`` may not run, else ``None``."""
+    if not is_read_only(sql):
+        return "not a single read-only SELECT"
+    try:
+        with conn.cursor() as cur:
+            cur.execute("EXPLAIN " + sql)
+    except Exception as e:
+        return f"EXPLAIN failed: {str(e).strip()}"
+    return None
+
+
+class _Executor:
+    """Validate and run queries on a pool of at most ``workers`` connections.
+
+    With a ``controller`` (the app's ``AdmissionController``) every query
+    also waits for an admission slot as ``session_id``, like an interactive one.
+    """
+
+    def __init__(self, db_url, workers, controller=None, session_id=None):
+        self.pool = ThreadedConnectionPool(1, workers, db_url)
+        # The pool raises instead of waiting when it is exhausted.
+        self._slots = threading.BoundedSemaphore(workers)
+        self.controller = controller
+        self.session_id = session_id
+
+    def run(self, sql):
+        with self._slots:
+            conn = self.pool.getconn()
+            try:
+                conn.set_session(autocommit=True, readonly=True)
+                error = validate(conn, sql)
+                if error:
+                    return None, error
+                if self.controller is None:
+                    return pd.read_sql_query(sql, conn), None
+                with self.controller.admit(self.session_id, estimate_cost(conn, sql)):
+                    return pd.read_sql_query(sql, conn), None
+            finally:
+                self.pool.putconn(conn, close=conn.closed != 0)
+
+    def close(self):
+        self.pool.closeall()
+
+
+def _slug(text, length=40):
+    return re.sub(r"[^a-z0-9]+", "-", text.lower()).strip("-")[:length].rstrip("-") or "question"
+
+
+def _run_one(index, question, client, limiter, executor, out_dir, row_limit):
+    result = {
+        "index": index,
+        "question": question,
+        "sql": None,
+        "status": "ok",
+        "error": None,
+        "rows": None,
+        "generate_s": None,
+        "execute_s": None,
+        "csv": None,
+    }
+    start = time.perf_counter()
+    try:
+        sql = generate_with_retry(client, question, limiter)
+    except Exception as e:
+        result.update(status="generation_failed", error=str(e).strip())
+        return result
+    finally:
+        result["generate_s"] = round(time.perf_counter() - start, 3)
+    sql = ensure_limit(sql, row_limit)
+    result["sql"] = sql
+
+    start = time.perf_counter()
+    try:
+        df, error = executor.run(sql)
+        status = "rejected"
+    except Exception as e:
+        df, error, status = None, str(e).strip(), "failed"
+    result["execute_s"] = round(time.perf_counter() - start, 3)
+    if df is None:
+        result.update(status=status, error=error)
+        return result
+
+    name = f"{index:02d}-{_slug(question)}.csv"
+    df.to_csv(out_dir / name, index=False)
+    result.update(rows=len(df), csv=name)
+    return result
+
+
+def summarize(results, elapsed_s):
+    statuses = [r["status"] for r in results]
+    return {
+        "questions": len(results),
+        "ok": statuses.count("ok"),
+        "rejected": statuses.count("rejected"),
+        "failed": statuses.count("failed") + statuses.count("generation_failed"),
+        "elapsed_s": round(elapsed_s, 2),
+    }
+
+
+def write_report(out_dir, results, summary):
+    (out_dir / "report.json").write_text(
+        json.dumps({"summary": summary, "results": results}, indent=2), encoding="utf-8"
+    )
+    lines = [
+        "# Batch report",
+        "",
+        f"{summary['questions']} questions in {summary['elapsed_s']:.1f}s: "
+        f"{summary['ok']} ok, {summary['rejected']} rejected, {summary['failed']} failed.",
+        "",
+        "| # | Question | Status | Rows | Generate (s) | Execute (s) | Result |",
+        "|---|----------|--------|------|--------------|-------------|--------|",
+    ]
+    for r in results:
+        question = r["question"].replace("|", "\\|")
+        rows = "" if r["rows"] is None else f"{r['rows']:,}"
+        execute_s = "" if r["execute_s"] is None else r["execute_s"]
+        csv = f"[{r['csv']}]({r['csv']})" if r["csv"] else ""
+        lines.append(
+            f"| {r['index']} | {question} | {r['status']} | {rows} | {r['generate_s']} | {execute_s} | {csv} |"
+        )
+    for r in results:
+        lines += ["", f"## {r['index']}. {r['question']}", ""]
+        if r["error"]:
+            lines += [f"**{r['status']}:** {r['error']}", ""]
+        if r["sql"]:
+            lines += ["```sql", r["sql"], "```"]
+    (out_dir / "report.md").write_text("\n".join(lines) + "\n", encoding="utf-8")
+
+
+def run_batch(
+    questions,
+    out_dir,
+    client,
+    db_url,
+    concurrency=BATCH_CONCURRENCY,
+    db_workers=BATCH_DB_WORKERS,
+    rpm=BATCH_RPM,
+    row_limit=BATCH_ROW_LIMIT,
+    progress=None,
+    controller=None,
+    session_id=None,
+):
+    """Answer every question and write the report into ``out_dir``.
+
+    ``progress(done, total, result)`` is called from the calling thread as
+    each question finishes. With an admission ``controller`` queries queue
+    as ``session_id`` alongside interactive ones. Returns
+    ``(results, summary)``, results in input order.
+    """
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    # Retries are handled here so they respect the shared rate limit.
+    client = client.with_options(max_retries=0)
+    limiter = RateLimiter(rpm)
+    executor = _Executor(db_url, db_workers, controller, session_id)
+    started = time.perf_counter()
+    results = []
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="batch") as pool:
+            futures = [
+                pool.submit(_run_one, index, question, client, limiter, executor, out_dir, row_limit)
+                for index, question in enumerate(questions, start=1)
+            ]
+            for future in as_completed(futures):
+                results.append(future.result())
+                if progress is not None:
+                    progress(len(results), len(questions), results[-1])
+    finally:
+        executor.close()
+    results.sort(key=lambda r: r["index"])
+    summary = summarize(results, time.perf_counter() - started)
+    write_report(out_dir, results, summary)
+    return results, summary
+
+
+def zip_report(out_dir):
+    """The report directory as zip bytes, for downloading from the app."""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        for path in sorted(Path(out_dir).iterdir()):
+            archive.write(path, path.name)
+    return buffer.getvalue()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Answer a file of questions and write a report.")
+    parser.add_argument("questions", type=Path, help="Text file with one question per line.")
+    parser.add_argument("--out", type=Path, default=Path("batch_report"), help="Report directory.")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY, help="Questions in flight.")
+    parser.add_argument("--db-workers", type=int, default=BATCH_DB_WORKERS, help="Database connections.")
+    parser.add_argument("--rpm", type=int, default=BATCH_RPM, help="OpenAI requests per minute.")
+    parser.add_argument("--row-limit", type=int, default=BATCH_ROW_LIMIT, help="LIMIT added to unbounded queries.")
+    args = parser.parse_args()
+
+    questions = read_questions(args.questions.read_text(encoding="utf-8"))
+    db_url = get_db_url(
+        CONNECT_TIMEOUT,
+        statement_timeout=BATCH_STATEMENT_TIMEOUT,
+        lock_timeout=BATCH_LOCK_TIMEOUT,
+    )
+
+    def report_progress(done, total, result):
+        print(f"[{done}/{total}] {result['status']:<17} {result['question']}")
+
+    results, summary = run_batch(
+        questions,
+        args.out,
+        openai.OpenAI(),
+        db_url,
+        concurrency=args.concurrency,
+        db_workers=args.db_workers,
+        rpm=args.rpm,
+        row_limit=args.row_limit,
+        progress=report_progress,
+    )
+    print(
+        f"{summary['ok']}/{summary['questions']} ok in {summary['elapsed_s']:.1f}s; "
+        f"report written to {args.out / 'report.md'}"
+    )
@@ -0,0 +1,74 @@
+import argparse
+import random
+import time
+
+from populate_db import (
+    ORDERDETAIL_COPY_COLUMNS,
+    CopyBuffer,
+    copy_rows_binary,
+    copy_rows_text,
+    get_connection,
+    get_pipeline_db_url,
+)
+
+BENCH_TABLE = "bench_orderdetail"
+
+
+def build_orderdetail_buffer(rows, customers=10_000, products=500, seed=42):
+    rng = random.Random(seed)
+    buffer = CopyBuffer(ORDERDETAIL_COPY_COLUMNS)
+    customer_ids, product_ids, order_dates, quantities = buffer.data
+    for _ in range(rows):
+        customer_ids.append(rng.randint(1, customers))
+        product_ids.append(rng.randint(1, products))
+        order_dates.append(rng.randint(8000, 9500))  # days since 2000-01-01
+        quantities.append(rng.randint(1, 10))
+    return buffer
+
+
+def run_benchmark(conn, buffer, repeat):
+    with conn.cursor() as cur:
+        cur.execute(f"""
+            CREATE TEMP TABLE IF NOT EXISTS {BENCH_TABLE} (
+                CustomerID INTEGER NOT NULL,
+                ProductID INTEGER NOT NULL,
+                OrderDate DATE NOT NULL,
+                QuantityOrdered INTEGER NOT NULL
+            )
+        """)
+    conn.commit()
+
+    results = {}
+    for name, writer in (("text", copy_rows_text), ("binary", copy_rows_binary)):
+        timings = []
+        for _ in range(repeat):
+            with conn.cursor() as cur:
+                cur.execute(f"TRUNCATE {BENCH_TABLE}")
+            conn.commit()
+            start = time.perf_counter()
+            payload = writer(conn, BENCH_TABLE, buffer)
+            timings.append(time.perf_counter() - start)
+        results[name] = (min(timings), payload)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare text and binary COPY on OrderDetail-shaped rows.")
+    parser.add_argument("--rows", type=int, default=500_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"Building {args.rows:,} OrderDetail rows...")
+    buffer = build_orderdetail_buffer(args.rows)
+
+    conn = get_connection(get_pipeline_db_url())
+    results = run_benchmark(conn, buffer, args.repeat)
+    conn.close()
+
+    for name, (elapsed, payload) in results.items():
+        print(
+            f"{name:>6}: {elapsed:.3f}s  {args.rows / elapsed:>12,.0f} rows/s  "
+            f"{payload / 1e6:>8.1f} MB sent"
+        )
+    speedup = results["text"][0] / results["binary"][0]
+    print(f"Binary COPY speedup: {speedup:.2f}x")
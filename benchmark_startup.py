@@ -0,0 +1,89 @@
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+APP_PATH = Path(__file__).with_name("streamlit_app.py")
+
+# Placeholder secrets: rendering the login screen and an idle workspace
+# never talks to PostgreSQL or OpenAI.
+BENCH_SECRETS = {
+    "OPENAI_API_KEY": "sk-benchmark",
+    "HASHED_PASSWORD": "$2b$04$abcdefghijklmnopqrstuu5M/mQc6J3U0F8yW0fFQ8yQ2x8yM3bW.",
+    "POSTGRES_USERNAME": "bench",
+    "POSTGRES_PASSWORD": "bench",
+    "POSTGRES_SERVER": "localhost",
+    "POSTGRES_DATABASE": "bench",
+}
+
+# Runs in a fresh interpreter so import costs are included.
+COLD_START_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+imported = time.perf_counter()
+at = AppTest.from_file(sys.argv[1], default_timeout=60)
+for key, value in json.loads(sys.argv[2]).items():
+    at.secrets[key] = value
+at.run()
+done = time.perf_counter()
+heavy = sorted(m for m in ("pandas", "psycopg2", "openai") if m in sys.modules)
+print(json.dumps({"harness": imported - start, "first_render": done - imported, "heavy_modules": heavy}))
+"""
+
+
+def measure_cold_start(runs):
+    samples = []
+    for _ in range(runs):
+        out = subprocess.run(
+            [sys.executable, "-c", COLD_START_SCRIPT, str(APP_PATH), json.dumps(BENCH_SECRETS)],
+            check=True,
+            capture_output=True,
+            text=True,
+        )
+        samples.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    return samples
+
+
+def measure_reruns(runs, logged_in):
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(str(APP_PATH), default_timeout=60)
+    for key, value in BENCH_SECRETS.items():
+        at.secrets[key] = value
+    at.session_state["logged_in"] = logged_in
+    at.run()
+
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        at.run()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def summarize(label, values):
+    values = sorted(values)
+    p95 = values[min(len(values) - 1, int(len(values) * 0.95))]
+    print(
+        f"{label:<26} median {statistics.median(values) * 1000:8.1f} ms   "
+        f"p95 {p95 * 1000:8.1f} ms   n={len(values)}"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure streamlit_app cold start and rerun render time.")
+    parser.add_argument("--cold-runs", type=int, default=5)
+    parser.add_argument("--reruns", type=int, default=30)
+    args = parser.parse_args()
+
+    cold = measure_cold_start(args.cold_runs)
+    summarize("cold: harness import", [s["harness"] for s in cold])
+    summarize("cold: login first render", [s["first_render"] for s in cold])
+    print(f"heavy modules loaded before login: {cold[-1]['heavy_modules'] or 'none'}")
+
+    summarize("rerun: login screen", measure_reruns(args.reruns, logged_in=False))
+    summarize("rerun: workspace", measure_reruns(args.reruns, logged_in=True))
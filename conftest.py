@@ -0,0 +1,2 @@
+# test_render_database.py is a command-line probe, not a test module.
+collect_ignore = ["test_render_database.py"]
@@ -1,8 +1,56 @@
-import bcrypt
+import argparse
 import getpass
+import statistics
+import time
+
+import bcrypt
+
+MIN_ROUNDS = 4
+MAX_ROUNDS = 16
+
+
+def time_checkpw(rounds, samples=3):
+    password = b"calibration-password"
+    hashed = bcrypt.hashpw(password, bcrypt.gensalt(rounds))
+    timings = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        bcrypt.checkpw(password, hashed)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def calibrate(target_ms, samples=3):
+    """Return the highest bcrypt cost whose verification fits ``target_ms`` on this host."""
+    best = MIN_ROUNDS
+    print(f"{'rounds':>6}  {'verify ms':>10}")
+    for rounds in range(MIN_ROUNDS, MAX_ROUNDS + 1):
+        elapsed_ms = time_checkpw(rounds, samples) * 1000
+        print(f"{rounds:>6}  {elapsed_ms:>10.1f}")
+        if elapsed_ms > target_ms:
+            break
+        best = rounds
+    print(f"Selected cost {best} for a {target_ms:.0f} ms verification target")
+    return best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Hash the workspace password with bcrypt.")
+    parser.add_argument("--rounds", type=int, help="bcrypt cost factor (default: bcrypt's own default)")
+    parser.add_argument(
+        "--calibrate",
+        action="store_true",
+        help="Benchmark bcrypt on this host and pick the cost that fits --target-ms.",
+    )
+    parser.add_argument("--target-ms", type=float, default=250, help="Target verification latency for --calibrate.")
+    args = parser.parse_args()
 
+    rounds = args.rounds
+    if args.calibrate:
+        rounds = calibrate(args.target_ms)
 
-password = getpass.getpass(prompt='Enter your password: ')
-password = password.encode('utf-8')
-hashed = bcrypt.hashpw(password, bcrypt.gensalt())
-print(hashed.decode())
\ No newline at end of file
+    password = getpass.getpass(prompt='Enter your password: ')
+    password = password.encode('utf-8')
+    salt = bcrypt.gensalt(rounds) if rounds else bcrypt.gensalt()
+    hashed = bcrypt.hashpw(password, salt)
+    print(hashed.decode())
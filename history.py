@@ -0,0 +1,199 @@
+"""Persistent query history in a local SQLite file.
+
+Every answered question is stored with its SQL, timings and a compressed
+Arrow IPC snapshot of the result, so a past result can be reopened without
+calling the LLM or the warehouse. An FTS5 index over questions and SQL,
+kept in sync by triggers, backs the search box.
+
+Connections are opened per call, which keeps the store safe to share between
+Streamlit sessions; WAL mode lets searches run while another session writes.
+"""
+import os
+import re
+import sqlite3
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+import pyarrow as pa
+
+HISTORY_PATH = os.getenv("HISTORY_PATH", "history.sqlite3")
+HISTORY_KEEP = int(os.getenv("HISTORY_KEEP", "2000"))
+# Larger snapshots are not kept; the entry is stored with its SQL only.
+HISTORY_MAX_SNAPSHOT_BYTES = int(os.getenv("HISTORY_MAX_SNAPSHOT_BYTES", str(16 << 20)))
+SNAPSHOT_CODEC = "zstd" if pa.Codec.is_available("zstd") else None
+BUSY_TIMEOUT_S = 5
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS query_history (
+    id INTEGER PRIMARY KEY,
+    created_at REAL NOT NULL,
+    question TEXT,
+    sql TEXT NOT NULL,
+    rows INTEGER,
+    generate_ms REAL,
+    run_ms REAL,
+    preview INTEGER NOT NULL DEFAULT 0,
+    snapshot BLOB,
+    snapshot_bytes INTEGER,
+    result_bytes INTEGER
+);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS query_history_fts USING fts5(
+    question, sql,
+    content='query_history', content_rowid='id',
+    tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+);
+
+CREATE TRIGGER IF NOT EXISTS query_history_ai AFTER INSERT ON query_history BEGIN
+    INSERT INTO query_history_fts (rowid, question, sql) VALUES (new.id, new.question, new.sql);
+END;
+
+CREATE TRIGGER IF NOT EXISTS query_history_ad AFTER DELETE ON query_history BEGIN
+    INSERT INTO query_history_fts (query_history_fts, rowid, question, sql)
+    VALUES ('delete', old.id, old.question, old.sql);
+END;
+
+CREATE TRIGGER IF NOT EXISTS query_history_au AFTER UPDATE OF question, sql ON query_history BEGIN
+    INSERT INTO query_history_fts (query_history_fts, rowid, question, sql)
+    VALUES ('delete', old.id, old.question, old.sql);
+    INSERT INTO query_history_fts (rowid, question, sql) VALUES (new.id, new.question, new.sql);
+END;
+"""
+
+# Every column except the snapshot itself.
+ENTRY_COLUMNS = "id, created_at, question, sql, rows, generate_ms, run_ms, preview, snapshot_bytes, result_bytes"
+
+
+def encode_snapshot(table):
+    """Compressed Arrow IPC stream for ``table``."""
+    sink = pa.BufferOutputStream()
+    options = pa.ipc.IpcWriteOptions(compression=SNAPSHOT_CODEC)
+    with pa.ipc.new_stream(sink, table.schema, options=options) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def decode_snapshot(blob):
+    return pa.ipc.open_stream(pa.py_buffer(blob)).read_all()
+
+
+def match_expression(text):
+    """FTS5 query matching every word of ``text`` as a prefix, or ``None``.
+
+    Words are quoted, so user input cannot be read as FTS5 syntax.
+    """
+    words = re.findall(r"\w+", text)
+    if not words:
+        return None
+    return " ".join(f'"{word}"*' for word in words)
+
+
+class HistoryStore:
+    def __init__(self, path=HISTORY_PATH, keep=HISTORY_KEEP, max_snapshot_bytes=HISTORY_MAX_SNAPSHOT_BYTES):
+        self.path = Path(path)
+        self.keep = keep
+        self.max_snapshot_bytes = max_snapshot_bytes
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        """Connection that commits on success and is always closed."""
+        conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT_S)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _snapshot(self, table):
+        if table is None:
+            return None, None
+        blob = encode_snapshot(table)
+        if len(blob) > self.max_snapshot_bytes:
+            return None, None
+        return blob, len(blob)
+
+    def add(self, question, sql, table, generate_ms=None, run_ms=None, preview=False):
+        """Store an answered question; returns the new entry id."""
+        blob, size = self._snapshot(table)
+        with self._connect() as conn:
+            cur = conn.execute(
+                """
+                INSERT INTO query_history
+                    (created_at, question, sql, rows, generate_ms, run_ms, preview, snapshot, snapshot_bytes, result_bytes)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (
+                    time.time(),
+                    question,
+                    sql,
+                    None if table is None else table.num_rows,
+                    generate_ms,
+                    run_ms,
+                    int(preview),
+                    blob,
+                    size,
+                    None if table is None else table.nbytes,
+                ),
+            )
+            entry_id = cur.lastrowid
+            if self.keep:
+                conn.execute(
+                    "DELETE FROM query_history WHERE id <= (SELECT id FROM query_history ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                    (self.keep,),
+                )
+        return entry_id
+
+    def replace_result(self, entry_id, table, run_ms=None):
+        """Swap an entry's preview snapshot for the exact result."""
+        blob, size = self._snapshot(table)
+        with self._connect() as conn:
+            conn.execute(
+                """
+                UPDATE query_history
+                SET rows = ?, run_ms = COALESCE(?, run_ms), preview = 0, snapshot = ?, snapshot_bytes = ?, result_bytes = ?
+                WHERE id = ?
+                """,
+                (table.num_rows, run_ms, blob, size, table.nbytes, entry_id),
+            )
+
+    def search(self, text="", limit=20):
+        """Entries matching ``text`` (best match first), or the latest entries if it is blank."""
+        expression = match_expression(text)
+        with self._connect() as conn:
+            if expression is None:
+                rows = conn.execute(
+                    f"SELECT {ENTRY_COLUMNS} FROM query_history ORDER BY id DESC LIMIT ?", (limit,)
+                ).fetchall()
+            else:
+                rows = conn.execute(
+                    f"""
+                    SELECT {", ".join("h." + column for column in ENTRY_COLUMNS.split(", "))}
+                    FROM query_history_fts f
+                    JOIN query_history h ON h.id = f.rowid
+                    WHERE query_history_fts MATCH ?
+                    ORDER BY bm25(query_history_fts, 2.0, 1.0), h.id DESC
+                    LIMIT ?
+                    """,
+                    (expression, limit),
+                ).fetchall()
+        return [dict(row) for row in rows]
+
+    def load(self, entry_id):
+        """``(entry, table)`` for ``entry_id``; ``table`` is ``None`` without a snapshot."""
+        with self._connect() as conn:
+            row = conn.execute(f"SELECT {ENTRY_COLUMNS}, snapshot FROM query_history WHERE id = ?", (entry_id,)).fetchone()
+        if row is None:
+            return None, None
+        entry = dict(row)
+        blob = entry.pop("snapshot")
+        return entry, None if blob is None else decode_snapshot(blob)
+
+    def count(self):
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM query_history").fetchone()[0]
@@ -0,0 +1,303 @@
+"""Concurrent-session load test for streamlit_app.py.
+
+Each simulated analyst drives the real app script through Streamlit's
+``AppTest``: log in, generate SQL, run the query. SQL generation goes to a
+local fake OpenAI endpoint with configurable latency, and queries run
+against the PostgreSQL database configured in ``.env`` (load it first with
+``populate_db.py``).
+
+Every session runs in its own process. ``AppTest`` swaps the process-wide
+Streamlit runtime and secrets while a script runs, so sessions on threads of
+one process break each other's runs. The flip side is that cached resources
+(connection pools, the admission queue) are per session here, as if each
+analyst had an app instance of their own.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import statistics
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import bcrypt
+import psycopg2
+
+from utils import get_db_url
+
+APP_PATH = Path(__file__).with_name("streamlit_app.py")
+LOAD_TEST_PASSWORD = "load-test-password"
+
+# Canned answers for the fake model, shaped like real completions.
+FAKE_SQL = [
+    "SELECT c.Country, COUNT(*) AS customers FROM Customer cu JOIN Country c ON cu.CountryID = c.CountryID GROUP BY c.Country ORDER BY customers DESC",
+    "SELECT r.Region, c.Country, COUNT(*) AS customers FROM Customer cu JOIN Country c ON cu.CountryID = c.CountryID JOIN Region r ON c.RegionID = r.RegionID GROUP BY r.Region, c.Country",
+    "SELECT p.ProductName, SUM(od.QuantityOrdered * p.ProductUnitPrice) AS revenue FROM OrderDetail od JOIN Product p ON od.ProductID = p.ProductID GROUP BY p.ProductName ORDER BY revenue DESC LIMIT 20",
+    "SELECT cu.City, COUNT(DISTINCT od.OrderID) AS orders FROM OrderDetail od JOIN Customer cu ON od.CustomerID = cu.CustomerID GROUP BY cu.City ORDER BY orders DESC LIMIT 20",
+]
+
+QUESTIONS = [
+    "How many customers does each country have?",
+    "Customers by region and country",
+    "Top 20 products by revenue",
+    "Which cities have the most orders?",
+]
+
+
+def start_fake_openai(latency_s, jitter_s):
+    """Serve ``/v1/chat/completions`` locally; returns the running server."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            time.sleep(max(0.0, latency_s + random.uniform(-jitter_s, jitter_s)))
+            body = json.dumps({
+                "id": "chatcmpl-loadtest",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": "gpt-4o-mini",
+                "choices": [{
+                    "index": 0,
+                    "finish_reason": "stop",
+                    "message": {"role": "assistant", "content": f"```sql\n{random.choice(FAKE_SQL)}\n```"},
+                }],
+                "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+            }).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def app_secrets(openai_url, hashed_password):
+    return {
+        "OPENAI_API_KEY": "sk-load-test",
+        "OPENAI_BASE_URL": openai_url,
+        "HASHED_PASSWORD": hashed_password,
+        "POSTGRES_USERNAME": os.environ["POSTGRES_USERNAME"],
+        "POSTGRES_PASSWORD": os.environ["POSTGRES_PASSWORD"],
+        "POSTGRES_SERVER": os.environ["POSTGRES_SERVER"],
+        "POSTGRES_DATABASE": os.environ["POSTGRES_DATABASE"],
+    }
+
+
+class ConnectionSampler(threading.Thread):
+    """Poll pg_stat_activity for the test database while the load runs."""
+
+    def __init__(self, db_url, interval_s=0.2):
+        super().__init__(daemon=True)
+        self.db_url = db_url
+        self.interval_s = interval_s
+        self.samples = []
+        self._stop_event = threading.Event()
+
+    def run(self):
+        conn = psycopg2.connect(self.db_url)
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            while not self._stop_event.is_set():
+                cur.execute("""
+                    SELECT COUNT(*), COUNT(*) FILTER (WHERE state = 'active')
+                    FROM pg_stat_activity
+                    WHERE datname = current_database() AND pid <> pg_backend_pid()
+                """)
+                self.samples.append(cur.fetchone())
+                self._stop_event.wait(self.interval_s)
+        conn.close()
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+def _timed_run(at, step, timings, errors):
+    start = time.perf_counter()
+    at.run()
+    timings[step].append(time.perf_counter() - start)
+    if at.exception or at.error:
+        errors[step] += 1
+        return False
+    return True
+
+
+def run_session(secrets, iterations, timings, errors, start_barrier=None):
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(str(APP_PATH), default_timeout=120)
+    for key, value in secrets.items():
+        at.secrets[key] = value
+    at.run()
+    if start_barrier is not None:
+        start_barrier.wait()
+
+    at.text_input("login_password").input(LOAD_TEST_PASSWORD)
+    at.button[0].click()
+    if not _timed_run(at, "login", timings, errors):
+        return 0
+
+    completed = 0
+    for _ in range(iterations):
+        at.text_area[0].input(random.choice(QUESTIONS))
+        at.button(key="gen_sql_btn").click()
+        if not _timed_run(at, "generate_sql", timings, errors):
+            continue
+        at.button(key="run_btn").click()
+        if _timed_run(at, "run_query", timings, errors):
+            completed += 1
+    return completed
+
+
+def _session_process(secrets, iterations, start_barrier, results):
+    """Run one session and send back ``(timings, errors, completed)``."""
+    # A running server has these imported already; keep each process's first
+    # import out of the timings.
+    import openai  # noqa: F401
+    import pandas  # noqa: F401
+
+    timings = defaultdict(list)
+    errors = defaultdict(int)
+    completed = 0
+    try:
+        completed = run_session(secrets, iterations, timings, errors, start_barrier)
+    except threading.BrokenBarrierError:
+        errors["start"] += 1
+    except Exception:
+        errors["session"] += 1
+        start_barrier.abort()
+    results.put((dict(timings), dict(errors), completed))
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def run_load_test(sessions, iterations, llm_latency_s, llm_jitter_s):
+    server = start_fake_openai(llm_latency_s, llm_jitter_s)
+    openai_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    hashed = bcrypt.hashpw(LOAD_TEST_PASSWORD.encode("utf-8"), bcrypt.gensalt(4)).decode()
+    secrets = app_secrets(openai_url, hashed)
+
+    sampler = ConnectionSampler(get_db_url())
+    sampler.start()
+
+    timings = defaultdict(list)
+    errors = defaultdict(int)
+    completed = []
+
+    # Spawn, not fork: this process already runs the server and sampler threads.
+    context = multiprocessing.get_context("spawn")
+    # Sessions start together once every process has imported the app.
+    start_barrier = context.Barrier(sessions + 1)
+    results = context.Queue()
+    processes = [
+        context.Process(
+            target=_session_process,
+            args=(secrets, iterations, start_barrier, results),
+            name=f"session-{i}",
+        )
+        for i in range(sessions)
+    ]
+    for process in processes:
+        process.start()
+    try:
+        start_barrier.wait()
+    except threading.BrokenBarrierError:
+        pass
+    start = time.perf_counter()
+    for _ in processes:
+        session_timings, session_errors, done = results.get()
+        for step, values in session_timings.items():
+            timings[step].extend(values)
+        for step, count in session_errors.items():
+            errors[step] += count
+        completed.append(done)
+    wall = time.perf_counter() - start
+    for process in processes:
+        process.join()
+
+    sampler.stop()
+    server.shutdown()
+
+    steps = {
+        step: {
+            "count": len(values),
+            "errors": errors[step],
+            "p50_ms": percentile(values, 50) * 1000,
+            "p95_ms": percentile(values, 95) * 1000,
+            "p99_ms": percentile(values, 99) * 1000,
+            "mean_ms": statistics.fmean(values) * 1000,
+        }
+        for step, values in timings.items() if values
+    }
+    # Sessions that died before timing a step still count as errors.
+    for step, count in errors.items():
+        steps.setdefault(step, {"count": 0, "errors": count, "p50_ms": 0.0, "p95_ms": 0.0, "p99_ms": 0.0, "mean_ms": 0.0})
+    totals = [s[0] for s in sampler.samples] or [0]
+    active = [s[1] for s in sampler.samples] or [0]
+    return {
+        "sessions": sessions,
+        "iterations": iterations,
+        "llm_latency_ms": llm_latency_s * 1000,
+        "wall_s": wall,
+        "completed_queries": sum(completed),
+        "throughput_qps": sum(completed) / wall if wall else 0.0,
+        "steps": steps,
+        "connections": {
+            "max_total": max(totals),
+            "max_active": max(active),
+            "mean_active": statistics.fmean(active),
+        },
+    }
+
+
+def print_report(report):
+    print(
+        f"{report['sessions']} sessions x {report['iterations']} iterations, "
+        f"LLM latency {report['llm_latency_ms']:.0f} ms"
+    )
+    print(
+        f"Completed {report['completed_queries']} queries in {report['wall_s']:.1f}s "
+        f"({report['throughput_qps']:.2f} queries/s)"
+    )
+    print(f"{'step':<14}{'n':>6}{'err':>5}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for step, s in report["steps"].items():
+        print(f"{step:<14}{s['count']:>6}{s['errors']:>5}{s['p50_ms']:>10.1f}{s['p95_ms']:>10.1f}{s['p99_ms']:>10.1f}")
+    c = report["connections"]
+    print(
+        f"DB connections: max total {c['max_total']}, max active {c['max_active']}, "
+        f"mean active {c['mean_active']:.2f}"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulate concurrent analysts against streamlit_app.py.")
+    parser.add_argument("--sessions", type=int, default=10)
+    parser.add_argument("--iterations", type=int, default=5, help="Questions asked per session.")
+    parser.add_argument("--llm-latency-ms", type=float, default=800)
+    parser.add_argument("--llm-jitter-ms", type=float, default=200)
+    parser.add_argument("--json", help="Also write the report to this file.")
+    args = parser.parse_args()
+
+    report = run_load_test(
+        args.sessions,
+        args.iterations,
+        args.llm_latency_ms / 1000,
+        args.llm_jitter_ms / 1000,
+    )
+    print_report(report)
+    if args.json:
+        Path(args.json).write_text(json.dumps(report, indent=2))
@@ -0,0 +1,267 @@
+"""Local DuckDB snapshot of the warehouse for interactive queries.
+
+``refresh`` copies the star-schema tables out of PostgreSQL into a DuckDB
+file next to the app; ``LocalReplica`` answers read-only queries from it with
+DuckDB's vectorized columnar engine. Queries the snapshot cannot answer
+(unknown functions, tables that are not copied, PostgreSQL catalogs) return
+``None`` so the caller can fall back to PostgreSQL.
+
+populate_db bumps a load marker in ``warehouse_load`` whenever it changes the
+core tables, and each snapshot records the marker it was copied at. A
+snapshot older than the warehouse is not used until it is refreshed.
+
+DuckDB is optional: without it ``AVAILABLE`` is false and nothing is routed.
+"""
+import os
+import re
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import psycopg2
+
+from replicas import is_read_only
+
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+AVAILABLE = duckdb is not None
+LOCAL_REPLICA_PATH = os.getenv("LOCAL_REPLICA_PATH", "warehouse.duckdb")
+# How long a warehouse load marker read is reused before asking again.
+LOCAL_REPLICA_CHECK_S = float(os.getenv("LOCAL_REPLICA_CHECK_S", "5"))
+
+# Make DuckDB answer like PostgreSQL: integer division truncates, unquoted
+# identifiers (and so result column names) fold to lower case, and NULLs
+# sort last ascending but first descending.
+SESSION_CONFIG = {
+    "integer_division": True,
+    "preserve_identifier_case": False,
+    "default_null_order": "nulls_last_on_asc_first_on_desc",
+}
+
+PG_TO_DUCKDB = {
+    "integer": "INTEGER",
+    "bigint": "BIGINT",
+    "smallint": "SMALLINT",
+    "real": "FLOAT",
+    "double precision": "DOUBLE",
+    "numeric": "DOUBLE",
+    "date": "DATE",
+    "text": "VARCHAR",
+    "character varying": "VARCHAR",
+    "boolean": "BOOLEAN",
+    "timestamp without time zone": "TIMESTAMP",
+    "timestamp with time zone": "TIMESTAMPTZ",
+}
+
+# Stored in this order so DuckDB's per-row-group min/max can skip date ranges.
+SORT_KEYS = {"OrderDetail": "OrderDate"}
+
+# References that mean something different (or nothing) outside PostgreSQL.
+_SERVER_ONLY = re.compile(
+    r"\b(pg_\w+|information_schema|version|current_database|current_user|current_schema|"
+    r"session_user|random|setseed|txid_\w+|inet_\w+)\b",
+    re.IGNORECASE,
+)
+
+
+def is_compatible(sql):
+    """True for read-only SQL that does not depend on the PostgreSQL server itself."""
+    return is_read_only(sql) and _SERVER_ONLY.search(sql) is None
+
+
+def mark_loaded(conn):
+    """Record that the core tables changed, making existing snapshots stale."""
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS warehouse_load (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                loaded_at TIMESTAMPTZ NOT NULL
+            )
+            """
+        )
+        cur.execute(
+            """
+            INSERT INTO warehouse_load (id, loaded_at) VALUES (1, clock_timestamp())
+            ON CONFLICT (id) DO UPDATE SET loaded_at = EXCLUDED.loaded_at
+            """
+        )
+    conn.commit()
+
+
+def warehouse_version(conn):
+    """Epoch seconds of the last ``mark_loaded``, or ``None`` if never marked."""
+    with conn.cursor() as cur:
+        cur.execute("SELECT to_regclass('warehouse_load') IS NOT NULL")
+        if not cur.fetchone()[0]:
+            return None
+        cur.execute("SELECT EXTRACT(EPOCH FROM loaded_at)::float8 FROM warehouse_load")
+        row = cur.fetchone()
+    return None if row is None else row[0]
+
+
+def _columns(cur, table):
+    cur.execute(
+        """
+        SELECT column_name, data_type
+        FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = lower(%s)
+        ORDER BY ordinal_position
+        """,
+        (table,),
+    )
+    return cur.fetchall()
+
+
+def refresh(conn, tables, path=LOCAL_REPLICA_PATH):
+    """Rebuild the snapshot at ``path`` from ``tables`` in PostgreSQL.
+
+    The new file is written alongside and swapped in with ``os.replace``, so
+    running apps keep reading the previous snapshot until they reopen it.
+    The snapshot records the warehouse load marker it was copied at.
+    Returns ``{table: rows}``.
+    """
+    path = Path(path).resolve()
+    counts = {}
+    # Read first: a load that finishes mid-copy bumps the marker past this.
+    version = warehouse_version(conn)
+    with tempfile.TemporaryDirectory(dir=path.parent, prefix=".replica-") as work:
+        work = Path(work)
+        target = work / path.name
+        local = duckdb.connect(str(target))
+        try:
+            with conn.cursor() as cur:
+                for table in tables:
+                    columns = _columns(cur, table)
+                    if not columns:
+                        raise RuntimeError(f"Table {table} not found in PostgreSQL")
+                    definition = ", ".join(
+                        f'"{name}" {PG_TO_DUCKDB.get(data_type, "VARCHAR")}' for name, data_type in columns
+                    )
+                    source = table
+                    if table in SORT_KEYS:
+                        source = f"(SELECT * FROM {table} ORDER BY {SORT_KEYS[table]})"
+                    dump = work / f"{table}.csv"
+                    with dump.open("wb") as f:
+                        cur.copy_expert(f"COPY {source} TO STDOUT WITH (FORMAT csv, HEADER)", f, size=1 << 20)
+                    local.execute(f"CREATE TABLE {table} ({definition})")
+                    quoted = str(dump).replace("'", "''")
+                    local.execute(f"COPY {table} FROM '{quoted}' (FORMAT csv, HEADER)")
+                    dump.unlink()
+                    counts[table] = local.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+            conn.commit()
+            local.execute("CREATE TABLE replica_meta (source_version DOUBLE, refreshed_at TIMESTAMP)")
+            local.execute("INSERT INTO replica_meta VALUES (?, now()::TIMESTAMP)", [version])
+            local.execute("CHECKPOINT")
+        finally:
+            local.close()
+        os.replace(target, path)
+    return counts
+
+
+class LocalReplica:
+    """Read-only access to the snapshot, reopened whenever ``refresh`` replaces it.
+
+    Each query runs on its own DuckDB cursor so concurrent Streamlit sessions
+    can share one instance. ``current_version()`` returns the warehouse's
+    load marker (see ``warehouse_version``); it is called at most every
+    ``check_interval_s`` and the snapshot is only used while it is at least
+    that new. Queries running longer than ``timeout_s`` are interrupted.
+    """
+
+    def __init__(self, path=LOCAL_REPLICA_PATH, current_version=None, check_interval_s=LOCAL_REPLICA_CHECK_S, timeout_s=None):
+        self.path = Path(path)
+        self.current_version = current_version
+        self.check_interval_s = check_interval_s
+        self.timeout_s = timeout_s
+        self._conn = None
+        self._mtime = None
+        self._source_version = None
+        self._warehouse_version = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        with self._lock:
+            mtime = self.path.stat().st_mtime_ns
+            if self._conn is None or mtime != self._mtime:
+                # The previous connection is left to the garbage collector:
+                # other sessions may still be reading from its cursors.
+                # duckdb.connect(path) would hand back the cached instance of
+                # the replaced file, so attach it to a fresh in-memory one.
+                conn = duckdb.connect(config=SESSION_CONFIG)
+                quoted = str(self.path).replace("'", "''")
+                conn.execute(f"ATTACH '{quoted}' AS snapshot (READ_ONLY)")
+                conn.execute("USE snapshot")
+                try:
+                    self._source_version = conn.execute("SELECT source_version FROM replica_meta").fetchone()[0]
+                except duckdb.Error:
+                    # Written before snapshots recorded their source.
+                    self._source_version = None
+                self._conn = conn
+                self._mtime = mtime
+            return self._conn
+
+    def _warehouse(self):
+        now = time.monotonic()
+        with self._lock:
+            if self._checked_at is not None and now - self._checked_at < self.check_interval_s:
+                return self._warehouse_version
+        version = self.current_version()
+        with self._lock:
+            self._warehouse_version, self._checked_at = version, now
+        return version
+
+    def is_fresh(self):
+        """True when the snapshot holds the warehouse's latest load."""
+        self._connection()
+        if self.current_version is None:
+            return True
+        warehouse = self._warehouse()
+        return warehouse is not None and self._source_version is not None and self._source_version >= warehouse
+
+    def available(self):
+        return AVAILABLE and self.path.exists()
+
+    def query(self, sql):
+        """DataFrame for ``sql``, or ``None`` if the snapshot cannot answer it.
+
+        Raises ``TimeoutError`` when the query runs past ``timeout_s``.
+        """
+        if not self.available() or not is_compatible(sql):
+            return None
+        try:
+            if not self.is_fresh():
+                return None
+            cur = self._connection().cursor()
+        except (OSError, duckdb.Error, psycopg2.Error):
+            # Includes a failed warehouse version check: PostgreSQL answers instead.
+            return None
+        timer = None
+        if self.timeout_s:
+            timer = threading.Timer(self.timeout_s, cur.interrupt)
+            timer.daemon = True
+            timer.start()
+        try:
+            cur.execute("USE snapshot")
+            cur.execute(sql)
+            types = [str(column[1]) for column in cur.description]
+            df = cur.df()
+        except duckdb.InterruptException:
+            raise TimeoutError(f"canceled on the local snapshot after {self.timeout_s:g}s") from None
+        except duckdb.Error:
+            return None
+        finally:
+            if timer is not None:
+                timer.cancel()
+            cur.close()
+        for index, type_name in enumerate(types):
+            # SUM over integers is HUGEINT in DuckDB (bigint in PostgreSQL),
+            # which pandas receives as float64.
+            if type_name == "HUGEINT":
+                df.isetitem(index, df.iloc[:, index].astype("Int64"))
+        return df
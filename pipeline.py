@@ -0,0 +1,153 @@
+import os
+import random
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from psycopg2 import errors
+
+LOCK_RETRIES = int(os.getenv("DB_LOCK_RETRIES", "4"))
+LOCK_BACKOFF_S = float(os.getenv("DB_LOCK_BACKOFF", "0.5"))
+
+# ``deps`` names other tasks that must finish first. Dependencies on tasks
+# that are not part of the run are treated as already satisfied, which is
+# what lets a caller rerun a subset of the graph.
+Task = namedtuple("Task", ["name", "func", "deps"], defaults=[()])
+
+TaskTiming = namedtuple("TaskTiming", ["name", "start", "end", "attempts", "worker"])
+
+
+def _run_with_retry(conn, name, func, retries, backoff):
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            func(conn)
+            return attempt
+        except errors.LockNotAvailable:
+            conn.rollback()
+            if attempt > retries:
+                raise
+            delay = backoff * 2 ** (attempt - 1) * (1 + random.random())
+            print(f"{name}: lock not available, retrying in {delay:.2f}s")
+            time.sleep(delay)
+
+
+def _check_acyclic(deps):
+    remaining = {name: set(d) for name, d in deps.items()}
+    while remaining:
+        ready = [name for name, d in remaining.items() if not d]
+        if not ready:
+            raise ValueError(f"Task graph has a cycle among: {sorted(remaining)}")
+        for name in ready:
+            del remaining[name]
+        for d in remaining.values():
+            d.difference_update(ready)
+
+
+def run_dag(tasks, connect, max_workers=3, on_complete=None,
+            retries=LOCK_RETRIES, backoff=LOCK_BACKOFF_S):
+    """Run ``tasks`` as soon as their dependencies finish.
+
+    Each worker thread lazily opens its own connection with ``connect()`` and
+    keeps it for the whole run. ``on_complete(conn, task)`` runs on the same
+    connection after a task succeeds; it is retried separately so a lock
+    timeout there never replays the task itself. Returns a list of
+    ``TaskTiming`` with offsets in seconds from the start of the run.
+    """
+    by_name = {task.name: task for task in tasks}
+    pending = {
+        task.name: {dep for dep in task.deps if dep in by_name}
+        for task in tasks
+    }
+    _check_acyclic(pending)
+
+    local = threading.local()
+    opened = []
+    opened_lock = threading.Lock()
+    run_start = time.monotonic()
+
+    def connection():
+        conn = getattr(local, "conn", None)
+        if conn is None:
+            conn = connect()
+            local.conn = conn
+            with opened_lock:
+                opened.append(conn)
+        return conn
+
+    def execute(task):
+        conn = connection()
+        start = time.monotonic() - run_start
+        attempts = _run_with_retry(conn, task.name, task.func, retries, backoff)
+        if on_complete is not None:
+            _run_with_retry(conn, task.name, lambda c: on_complete(c, task), retries, backoff)
+        end = time.monotonic() - run_start
+        return TaskTiming(task.name, start, end, attempts, threading.current_thread().name)
+
+    timings = []
+    failure = None
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="pipeline") as pool:
+            running = {}
+            while pending or running:
+                if failure is None:
+                    for name in [n for n, d in pending.items() if not d]:
+                        del pending[name]
+                        running[pool.submit(execute, by_name[name])] = name
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        timings.append(future.result())
+                    except Exception as exc:
+                        print(f"{name} failed: {exc}")
+                        failure = failure or exc
+                        continue
+                    for d in pending.values():
+                        d.discard(name)
+    finally:
+        for conn in opened:
+            conn.close()
+
+    if failure is not None:
+        raise failure
+    return timings
+
+
+def critical_path(tasks, timings):
+    """Return ``(names, seconds)`` for the longest dependency chain."""
+    durations = {t.name: t.end - t.start for t in timings}
+    best = {}
+
+    def longest(name):
+        if name not in best:
+            task = next(t for t in tasks if t.name == name)
+            chains = [longest(dep) for dep in task.deps if dep in durations]
+            names, seconds = max(chains, key=lambda c: c[1], default=([], 0.0))
+            best[name] = (names + [name], seconds + durations[name])
+        return best[name]
+
+    return max((longest(name) for name in durations), key=lambda c: c[1], default=([], 0.0))
+
+
+def format_gantt(timings, width=48):
+    """Render task timings as a text Gantt chart."""
+    if not timings:
+        return "No tasks ran."
+    total = max(t.end for t in timings) or 1e-9
+    label_width = max(len(t.name) for t in timings)
+    lines = [f"Task timeline (wall clock {total:.2f}s):"]
+    for t in sorted(timings, key=lambda t: (t.start, t.name)):
+        left = min(int(round(t.start / total * width)), width - 1)
+        bar = max(1, int(round((t.end - t.start) / total * width)))
+        bar = min(bar, width - left)
+        retries = f"  ({t.attempts - 1} retries)" if t.attempts > 1 else ""
+        lines.append(
+            f"  {t.name:<{label_width}} |{' ' * left}{'#' * bar}{' ' * (width - left - bar)}| "
+            f"{t.start:>7.2f}s -> {t.end:>7.2f}s  [{t.worker}]{retries}"
+        )
+    return "\n".join(lines)
@@ -1,17 +1,54 @@
+import argparse
 import os
 import sys
 import psycopg2
-from psycopg2 import extras, errors
+from psycopg2 import errors
 import csv
+import struct
+from array import array
+from datetime import date
 from pathlib import Path
 import time
 
+import local_replica
+from pipeline import Task, critical_path, format_gantt, run_dag
+from sources import open_text, resolve_input
+from validation import LineCounter, Rejects, validated_rows
 from utils import get_db_url
 
-csv.field_size_limit(sys.maxsize)
+# Largest single CSV field accepted; a row with an unterminated quote fails
+# here instead of reading the rest of the file into one value.
+FIELD_SIZE_LIMIT = int(os.getenv("DB_FIELD_SIZE_LIMIT", str(1 << 20)))
+csv.field_size_limit(FIELD_SIZE_LIMIT)
 LOCK_TIMEOUT = os.getenv("DB_LOCK_TIMEOUT", "5s")
 STATEMENT_TIMEOUT = os.getenv("DB_STATEMENT_TIMEOUT", "300s")
 CONNECT_TIMEOUT = int(os.getenv("DB_CONNECT_TIMEOUT", "10"))
+# Session settings applied through libpq ``options`` at connection startup.
+PIPELINE_DB_SETTINGS = {
+    "lock_timeout": LOCK_TIMEOUT,
+    "statement_timeout": STATEMENT_TIMEOUT,
+}
+PIPELINE_WORKERS = int(os.getenv("DB_PIPELINE_WORKERS", "3"))
+STATISTICS_TARGET = int(os.getenv("DB_STATISTICS_TARGET", "500"))
+COPY_CHUNK_ROWS = int(os.getenv("DB_COPY_CHUNK_ROWS", "50000"))
+# Records staged per COPY and transaction.
+STAGE_BATCH_ROWS = int(os.getenv("DB_STAGE_BATCH_ROWS", "5000"))
+
+# Binary COPY framing: signature, flags, header extension length, trailer.
+PGCOPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack("!ii", 0, 0)
+PGCOPY_TRAILER = struct.pack("!h", -1)
+PG_EPOCH_ORDINAL = date(2000, 1, 1).toordinal()
+
+# PostgreSQL type -> (array typecode, struct format, wire size). Text columns
+# have no fixed-width encoding and are buffered as plain lists instead.
+COPY_TYPES = {
+    "integer": ("i", "i", 4),
+    "bigint": ("q", "q", 8),
+    "real": ("f", "f", 4),
+    "double precision": ("d", "d", 8),
+    "date": ("i", "i", 4),
+    "text": (None, None, None),
+}
 
 DROP_TABLES_SQL = [
     "DROP TABLE IF EXISTS OrderDetail CASCADE",
@@ -25,7 +62,8 @@ DROP_TABLES_SQL = [
     "DROP TABLE IF EXISTS stage_product_category CASCADE",
     "DROP TABLE IF EXISTS stage_customer CASCADE",
     "DROP TABLE IF EXISTS stage_country CASCADE",
-    "DROP TABLE IF EXISTS stage_region CASCADE"
+    "DROP TABLE IF EXISTS stage_region CASCADE",
+    "DROP TABLE IF EXISTS stage_reject CASCADE",
 ]
 
 CREATE_TABLE_SQL = """
@@ -66,6 +104,15 @@ CREATE TABLE IF NOT EXISTS stage_orderdetail (
     QuantityOrdered INTEGER
 );
 
+-- Records the staging loader refused, with the reason
+CREATE TABLE IF NOT EXISTS stage_reject (
+    Source TEXT NOT NULL,
+    LineNumber INTEGER NOT NULL,
+    Reason TEXT NOT NULL,
+    RawRecord TEXT,
+    RejectedAt TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
 -- Core tables
 CREATE TABLE IF NOT EXISTS Region (
     RegionID SERIAL PRIMARY KEY,
@@ -112,11 +159,43 @@ CREATE TABLE IF NOT EXISTS OrderDetail (
 );
 """
 
+# Column-level targets for skewed join keys plus extended statistics on
+# columns the planner would otherwise treat as independent.
+STATISTICS_SQL = [
+    f"ALTER TABLE OrderDetail ALTER COLUMN CustomerID SET STATISTICS {STATISTICS_TARGET}",
+    f"ALTER TABLE OrderDetail ALTER COLUMN ProductID SET STATISTICS {STATISTICS_TARGET}",
+    f"ALTER TABLE Customer ALTER COLUMN City SET STATISTICS {STATISTICS_TARGET}",
+    "CREATE STATISTICS IF NOT EXISTS stage_customer_geo_stats (dependencies, ndistinct) "
+    "ON Country, Region FROM stage_customer",
+    "CREATE STATISTICS IF NOT EXISTS stage_customer_city_stats (dependencies, ndistinct) "
+    "ON City, Country FROM stage_customer",
+    "CREATE STATISTICS IF NOT EXISTS country_region_stats (dependencies, ndistinct) "
+    "ON Country, RegionID FROM Country",
+    "CREATE STATISTICS IF NOT EXISTS customer_city_stats (dependencies, ndistinct, mcv) "
+    "ON City, CountryID FROM Customer",
+]
+
+# Tables written by each pipeline task; they are analyzed as soon as the
+# task finishes so the next task (and the first analyst queries) plan
+# against fresh statistics.
+TASK_TABLES = {
+    "staging": ["stage_customer"],
+    "region": ["Region"],
+    "country": ["Country"],
+    "product_category": ["ProductCategory"],
+    "customer": ["Customer"],
+    "product": ["Product"],
+    "facts": ["OrderDetail"],
+}
+
+CORE_TABLES = ["Region", "Country", "Customer", "ProductCategory", "Product", "OrderDetail"]
+
 FILES = {
     "data": {
         "filename": "data.csv",
-        "batch_size": 5000,
-        "stage_table": "stage_customer"
+        "batch_size": STAGE_BATCH_ROWS,
+        "stage_table": "stage_customer",
+        "required": ["Name", "Country", "Region"],
     }
 }
 
@@ -132,13 +211,20 @@ EXPECTED_COLUMNS = {
 }
 
 
+ORDERDETAIL_COPY_COLUMNS = [
+    ("CustomerID", "integer"),
+    ("ProductID", "integer"),
+    ("OrderDate", "date"),
+    ("QuantityOrdered", "integer"),
+]
+
+
+def get_pipeline_db_url():
+    return get_db_url(connect_timeout=CONNECT_TIMEOUT, **PIPELINE_DB_SETTINGS)
+
+
 def get_connection(db_url):
-    conn = psycopg2.connect(db_url, connect_timeout=CONNECT_TIMEOUT)
-    with conn.cursor() as cur:
-        cur.execute("SET lock_timeout = %s;", (LOCK_TIMEOUT,))
-        cur.execute("SET statement_timeout = %s;", (STATEMENT_TIMEOUT,))
-    conn.commit()
-    return conn
+    return psycopg2.connect(db_url)
 
 
 def drop_existing_tables(conn):
@@ -159,54 +245,291 @@ def drop_existing_tables(conn):
 def create_tables(conn):
     with conn.cursor() as cur:
         cur.execute(CREATE_TABLE_SQL)
+        for stmt in STATISTICS_SQL:
+            cur.execute(stmt)
     conn.commit()
     print("Tables created successfully")
 
 
-def load_tsv_to_stage(conn, filepath, stage_table, expected_columns, batch_size=5000, delimiter="\t"):
+def analyze_tables(conn, tables):
+    with conn.cursor() as cur:
+        for table in tables:
+            start_time = time.monotonic()
+            cur.execute(f"ANALYZE {table}")
+            conn.commit()
+            print(f"Analyzed {table}. Elapsed: {time.monotonic() - start_time:.2f}s")
+
+
+def vacuum_freeze_tables(conn, tables):
+    # VACUUM refuses to run inside a transaction block.
+    autocommit = conn.autocommit
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            for table in tables:
+                start_time = time.monotonic()
+                cur.execute(f"VACUUM (FREEZE) {table}")
+                print(f"Vacuumed (freeze) {table}. Elapsed: {time.monotonic() - start_time:.2f}s")
+    finally:
+        conn.autocommit = autocommit
+
+
+def _insert_stage_batch(conn, cursor, stage_table, sql, batch, rejects, buffer):
+    """COPY ``batch`` of ``(line, values)`` through ``buffer``; returns the rows inserted.
+
+    If the batch as a whole fails, it is retried row by row with ``sql``
+    under a savepoint so only the rows the database refuses are rejected.
+    """
+    buffer.clear()
+    for _, values in batch:
+        buffer.append(values)
+    try:
+        # Not committed here: the caller commits with the batch's rejects.
+        copy_rows_text(conn, stage_table, buffer, commit=False)
+        return len(batch)
+    except (errors.DataError, errors.IntegrityError):
+        conn.rollback()
+
+    inserted = 0
+    for line, values in batch:
+        cursor.execute("SAVEPOINT stage_row")
+        try:
+            cursor.execute(sql, values)
+        except (errors.DataError, errors.IntegrityError) as e:
+            cursor.execute("ROLLBACK TO SAVEPOINT stage_row")
+            rejects.add(line, f"rejected by database: {e.diag.message_primary}", values)
+        else:
+            cursor.execute("RELEASE SAVEPOINT stage_row")
+            inserted += 1
+    return inserted
+
+
+def load_tsv_to_stage(conn, filepath, stage_table, expected_columns, batch_size=STAGE_BATCH_ROWS, delimiter="\t", required=()):
+    """Load a plain, gzip, bz2 or zstd delimited file into ``stage_table``.
+
+    Valid records are streamed in with COPY, one batch per transaction.
+    Records that fail validation (``required`` columns empty, bad encoding,
+    wrong field count, over-long fields) or that the database refuses go to
+    ``stage_reject`` and a rejects file instead of stopping the load.
+    """
     path = Path(filepath)
     if not path.exists():
         raise FileNotFoundError(f"Missing file: {filepath}")
 
-    with path.open("r", encoding="utf-8-sig") as csvfile:
-        csv_reader = csv.DictReader(csvfile, delimiter=delimiter)
+    start_time = time.monotonic()
+    # surrogateescape lets validation reject undecodable records one by one.
+    with open_text(path, errors="surrogateescape") as (csvfile, stats):
+        lines = LineCounter(csvfile)
+        csv_reader = csv.DictReader(lines, delimiter=delimiter)
         missing = sorted(set(expected_columns) - set(csv_reader.fieldnames))
         if missing:
             raise ValueError(f"{filepath} missing expected columns: {missing}")
 
         placeholders = ", ".join(["%s"] * len(expected_columns))
         sql = f"INSERT INTO {stage_table} ({', '.join(expected_columns)}) VALUES ({placeholders})"
-        rows, total_count = [], 0
+        batch, total_count = [], 0
+        buffer = CopyBuffer([(column, "text") for column in expected_columns])
         cursor = conn.cursor()
 
         cursor.execute(f"DELETE FROM {stage_table}")
+        rejects = Rejects(conn, path)
         conn.commit()
         print(f"Cleaned up rows from {stage_table}")
 
-        for row in csv_reader:
-            rows.append([row.get(c, None) for c in expected_columns])
-            if len(rows) == batch_size:
-                extras.execute_batch(cursor, sql, rows)
-                conn.commit()
-                total_count += len(rows)
-                rows = []
-                print(f"Inserted {total_count:,} rows...")
-
-        if rows:
-            extras.execute_batch(cursor, sql, rows)
+        try:
+            for line, values in validated_rows(csv_reader, lines, expected_columns, required, rejects):
+                batch.append((line, values))
+                if len(batch) == batch_size:
+                    total_count += _insert_stage_batch(conn, cursor, stage_table, sql, batch, rejects, buffer)
+                    rejects.flush(cursor)
+                    conn.commit()
+                    batch = []
+                    print(f"Inserted {total_count:,} rows...")
+
+            if batch:
+                inserted = _insert_stage_batch(conn, cursor, stage_table, sql, batch, rejects, buffer)
+                total_count += inserted
+                print(f"Inserted final {inserted:,} rows; total: {total_count:,}")
+            rejects.flush(cursor)
             conn.commit()
-            total_count += len(rows)
-            print(f"Inserted final {len(rows):,} rows; total: {total_count:,}")
+            rejects.check_ratio()
+        finally:
+            rejects.close()
 
         cursor.close()
-        print(f"Finished loading data into {stage_table}")
+    print(f"Finished loading data into {stage_table}")
+    if rejects.count:
+        print(f"Rejected {rejects.count:,} of {rejects.seen:,} records; see {rejects.path} and stage_reject")
+    print(f"Read {stats.describe(time.monotonic() - start_time)}")
+
+
+class CopyBuffer:
+    """Column-oriented row buffer feeding the COPY writers.
+
+    Fixed-width columns are stored in ``array.array`` so they can be encoded
+    into the binary wire format without touching each value in Python. Those
+    columns are NOT NULL by construction; text columns accept ``None``.
+    Dates are held as days since 2000-01-01, PostgreSQL's own epoch.
+    """
+
+    def __init__(self, columns):
+        for _, pg_type in columns:
+            if pg_type not in COPY_TYPES:
+                raise ValueError(f"Unsupported COPY column type: {pg_type}")
+        self.columns = [name for name, _ in columns]
+        self.types = [pg_type for _, pg_type in columns]
+        self.data = [
+            array(COPY_TYPES[t][0]) if COPY_TYPES[t][0] else []
+            for t in self.types
+        ]
+
+    def __len__(self):
+        return len(self.data[0]) if self.data else 0
+
+    def append(self, row):
+        for buf, pg_type, value in zip(self.data, self.types, row):
+            if pg_type == "date" and not isinstance(value, int):
+                if isinstance(value, str):
+                    value = date.fromisoformat(value)
+                value = value.toordinal() - PG_EPOCH_ORDINAL
+            buf.append(value)
+
+    def clear(self):
+        for buf in self.data:
+            del buf[:]
+
+    @property
+    def fixed_width(self):
+        return all(COPY_TYPES[t][0] for t in self.types)
+
+
+def _encode_binary_fixed(buffer, start, stop):
+    # Every row has the same layout, so build one template row, repeat it and
+    # scatter each column's big-endian bytes into place with strided slices.
+    template = bytearray(struct.pack("!h", len(buffer.types)))
+    offsets = []
+    for pg_type in buffer.types:
+        size = COPY_TYPES[pg_type][2]
+        template += struct.pack("!i", size)
+        offsets.append(len(template))
+        template += bytes(size)
+    row_size = len(template)
+    out = template * (stop - start)
+    for data, offset in zip(buffer.data, offsets):
+        column = data[start:stop]
+        if sys.byteorder == "little":
+            column.byteswap()
+        raw = column.tobytes()
+        size = column.itemsize
+        for j in range(size):
+            out[offset + j::row_size] = raw[j::size]
+    return out
+
+
+def _encode_binary_mixed(buffer, start, stop):
+    field_count = struct.pack("!h", len(buffer.types))
+    packers = [
+        (struct.Struct("!i" + COPY_TYPES[t][1]), COPY_TYPES[t][2]) if COPY_TYPES[t][0] else (None, None)
+        for t in buffer.types
+    ]
+    null_field = struct.pack("!i", -1)
+    out = bytearray()
+    for i in range(start, stop):
+        out += field_count
+        for data, (packer, size) in zip(buffer.data, packers):
+            value = data[i]
+            if packer is not None:
+                out += packer.pack(size, value)
+            elif value is None:
+                out += null_field
+            else:
+                encoded = value.encode("utf-8")
+                out += struct.pack("!i", len(encoded))
+                out += encoded
+    return out
+
+
+def _escape_copy_text(value):
+    return (
+        value.replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+def _encode_text(buffer, start, stop):
+    columns = []
+    for data, pg_type in zip(buffer.data, buffer.types):
+        if pg_type == "date":
+            columns.append([date.fromordinal(v + PG_EPOCH_ORDINAL).isoformat() for v in data[start:stop]])
+        elif pg_type == "text":
+            columns.append(["\\N" if v is None else _escape_copy_text(v) for v in data[start:stop]])
+        else:
+            columns.append([repr(v) for v in data[start:stop]])
+    lines = ["\t".join(fields) for fields in zip(*columns)]
+    return ("\n".join(lines) + "\n").encode("utf-8") if lines else b""
+
+
+class _CopyStream:
+    """File-like reader handed to ``copy_expert``; encodes one chunk per read."""
+
+    def __init__(self, buffer, encode, header=b"", trailer=b"", chunk_rows=COPY_CHUNK_ROWS):
+        self._pieces = self._generate(buffer, encode, header, trailer, chunk_rows)
+        self.bytes_sent = 0
+
+    @staticmethod
+    def _generate(buffer, encode, header, trailer, chunk_rows):
+        if header:
+            yield header
+        for start in range(0, len(buffer), chunk_rows):
+            yield bytes(encode(buffer, start, min(start + chunk_rows, len(buffer))))
+        if trailer:
+            yield trailer
+
+    def read(self, size=-1):
+        piece = next(self._pieces, b"")
+        self.bytes_sent += len(piece)
+        return piece
+
+    readline = read
+
+
+def _copy_buffer(conn, table, buffer, stream, options, commit):
+    sql = f"COPY {table} ({', '.join(buffer.columns)}) FROM STDIN WITH ({options})"
+    with conn.cursor() as cur:
+        cur.copy_expert(sql, stream, size=1 << 20)
+    if commit:
+        conn.commit()
+    return stream.bytes_sent
+
+
+def copy_rows_binary(conn, table, buffer, chunk_rows=COPY_CHUNK_ROWS, commit=True):
+    """Stream ``buffer`` into ``table`` using the binary COPY format.
+
+    Returns the number of payload bytes sent to the server.
+    """
+    encode = _encode_binary_fixed if buffer.fixed_width else _encode_binary_mixed
+    stream = _CopyStream(buffer, encode, PGCOPY_HEADER, PGCOPY_TRAILER, chunk_rows)
+    return _copy_buffer(conn, table, buffer, stream, "FORMAT binary", commit)
+
+
+def copy_rows_text(conn, table, buffer, chunk_rows=COPY_CHUNK_ROWS, commit=True):
+    """Stream ``buffer`` into ``table`` using the text COPY format.
+
+    Text columns encode faster this way than in the binary format, which
+    packs them one value at a time. Returns the number of payload bytes
+    sent to the server.
+    """
+    stream = _CopyStream(buffer, _encode_text, chunk_rows=chunk_rows)
+    return _copy_buffer(conn, table, buffer, stream, "FORMAT text", commit)
 
 
 def load_all_staging(conn):
     for name, meta in FILES.items():
-        filename = meta["filename"]
-        if not Path(filename).exists():
-            print(f"Skipping {filename} (file not found)")
+        filename = resolve_input(meta["filename"])
+        if filename is None:
+            print(f"Skipping {meta['filename']} (file not found)")
             continue
         stage_table = meta.get("stage_table", f"stage_{name}")
         load_tsv_to_stage(
@@ -214,77 +537,83 @@ def load_all_staging(conn):
             filename,
             stage_table,
             EXPECTED_COLUMNS[name],
-            meta.get("batch_size", 5000),
+            meta.get("batch_size", STAGE_BATCH_ROWS),
             meta.get("delimiter", "\t"),
+            meta.get("required", ()),
         )
 
 
-def build_dimensions(conn):
-    cur = conn.cursor()
+def build_region(conn):
+    with conn.cursor() as cur:
+        cur.execute("""
+            INSERT INTO Region(Region)
+            SELECT DISTINCT Region FROM stage_customer
+            WHERE Region IS NOT NULL AND Region <> ''
+            ON CONFLICT (Region) DO NOTHING;
+        """)
+    conn.commit()
+    print("Region populated")
 
-    # Region
-    cur.execute("""
-        INSERT INTO Region(Region)
-        SELECT DISTINCT Region FROM stage_customer
-        WHERE Region IS NOT NULL AND Region <> ''
-        ON CONFLICT (Region) DO NOTHING;
-    """)
 
-    # Country
-    cur.execute("""
-        INSERT INTO Country(Country, RegionID)
-        SELECT DISTINCT s.Country, r.RegionID
-        FROM stage_customer s
-        JOIN Region r ON s.Region = r.Region
-        WHERE s.Country IS NOT NULL AND s.Country <> ''
-        ON CONFLICT (Country) DO NOTHING;
-    """)
+def build_country(conn):
+    with conn.cursor() as cur:
+        cur.execute("""
+            INSERT INTO Country(Country, RegionID)
+            SELECT DISTINCT s.Country, r.RegionID
+            FROM stage_customer s
+            JOIN Region r ON s.Region = r.Region
+            WHERE s.Country IS NOT NULL AND s.Country <> ''
+            ON CONFLICT (Country) DO NOTHING;
+        """)
+    conn.commit()
+    print("Country populated")
 
-    # ProductCategory - using distinct product names’ first tokens (mock logic)
-    cur.execute("""
-        INSERT INTO ProductCategory(ProductCategory, ProductCategoryDescription)
-        SELECT DISTINCT LEFT(ProductName, 5), 'Auto-generated'
-        FROM stage_customer
-        WHERE ProductName IS NOT NULL AND ProductName <> ''
-        ON CONFLICT (ProductCategory) DO NOTHING;
-    """)
 
+def build_product_category(conn):
+    # ProductCategory - using distinct product names’ first tokens (mock logic)
+    with conn.cursor() as cur:
+        cur.execute("""
+            INSERT INTO ProductCategory(ProductCategory, ProductCategoryDescription)
+            SELECT DISTINCT LEFT(ProductName, 5), 'Auto-generated'
+            FROM stage_customer
+            WHERE ProductName IS NOT NULL AND ProductName <> ''
+            ON CONFLICT (ProductCategory) DO NOTHING;
+        """)
     conn.commit()
-    cur.close()
-    print("Dimension tables populated")
+    print("ProductCategory populated")
 
 
-def load_entities(conn):
-    cur = conn.cursor()
-
-    # Customer
-    cur.execute("""
-        INSERT INTO Customer(FirstName, LastName, Address, City, CountryID)
-        SELECT
-            SPLIT_PART(Name, ' ', 1),
-            COALESCE(NULLIF(SPLIT_PART(Name, ' ', 2), ''), 'Unknown'),
-            Address,
-            City,
-            c.CountryID
-        FROM stage_customer s
-        JOIN Country c ON s.Country = c.Country
-        ON CONFLICT DO NOTHING;
-    """)
+def load_customers(conn):
+    with conn.cursor() as cur:
+        cur.execute("""
+            INSERT INTO Customer(FirstName, LastName, Address, City, CountryID)
+            SELECT
+                SPLIT_PART(Name, ' ', 1),
+                COALESCE(NULLIF(SPLIT_PART(Name, ' ', 2), ''), 'Unknown'),
+                Address,
+                City,
+                c.CountryID
+            FROM stage_customer s
+            JOIN Country c ON s.Country = c.Country
+            ON CONFLICT DO NOTHING;
+        """)
+    conn.commit()
+    print("Customer populated")
 
-    # Product
-    cur.execute("""
-        INSERT INTO Product(ProductName, ProductUnitPrice, ProductCategoryID)
-        SELECT DISTINCT
-            UNNEST(STRING_TO_ARRAY(ProductName, ';')) AS Product,
-            ROUND((random() * 100 + 1)::numeric, 2) AS UnitPrice,
-            1
-        FROM stage_customer
-        ON CONFLICT (ProductName) DO NOTHING;
-    """)
 
+def load_products(conn):
+    with conn.cursor() as cur:
+        cur.execute("""
+            INSERT INTO Product(ProductName, ProductUnitPrice, ProductCategoryID)
+            SELECT DISTINCT
+                UNNEST(STRING_TO_ARRAY(ProductName, ';')) AS Product,
+                ROUND((random() * 100 + 1)::numeric, 2) AS UnitPrice,
+                1
+            FROM stage_customer
+            ON CONFLICT (ProductName) DO NOTHING;
+        """)
     conn.commit()
-    cur.close()
-    print("Entity tables populated")
+    print("Product populated")
 
 
 def build_facts(conn):
@@ -309,37 +638,107 @@ def build_facts(conn):
     print("Fact tables populated")
 
 
-if __name__ == "__main__":
-    DATABASE_URL = get_db_url()
-
-    print("Creating tables...")
-    conn = get_connection(DATABASE_URL)
+def prepare_schema(conn):
     drop_existing_tables(conn)
     create_tables(conn)
-    conn.close()
-    print()
 
-    print("Loading staging data...")
-    start_time = time.monotonic()
-    conn = get_connection(DATABASE_URL)
-    load_all_staging(conn)
-    conn.close()
-    end_time = time.monotonic()
-    print(f"Staging data loaded. Elapsed: {end_time - start_time:.2f}s\n")
-
-    print("Building dimensions...")
-    conn = get_connection(DATABASE_URL)
-    build_dimensions(conn)
-    conn.close()
-
-    print("Loading entities...")
-    conn = get_connection(DATABASE_URL)
-    load_entities(conn)
-    conn.close()
-
-    print("Building facts...")
-    conn = get_connection(DATABASE_URL)
-    build_facts(conn)
-    conn.close()
+
+def run_maintenance(conn):
+    vacuum_freeze_tables(conn, CORE_TABLES)
+
+
+def refresh_local_replica(conn):
+    """Snapshot the core tables into the app's local DuckDB file, if DuckDB is installed."""
+    if not local_replica.AVAILABLE or not local_replica.LOCAL_REPLICA_PATH:
+        print("Local replica skipped (duckdb not installed or LOCAL_REPLICA_PATH empty)")
+        return
+    counts = local_replica.refresh(conn, CORE_TABLES)
+    print(f"Local replica refreshed: {local_replica.LOCAL_REPLICA_PATH} ({sum(counts.values()):,} rows)")
+
+
+# The load as a dependency graph. Region -> Country -> Customer and
+# ProductCategory -> Product are independent chains, so they run
+# concurrently on separate connections; names are accepted by --only.
+TASKS = [
+    Task("schema", prepare_schema),
+    Task("staging", load_all_staging, ("schema",)),
+    Task("region", build_region, ("staging",)),
+    Task("country", build_country, ("region",)),
+    Task("product_category", build_product_category, ("staging",)),
+    Task("customer", load_customers, ("country",)),
+    Task("product", load_products, ("product_category",)),
+    Task("facts", build_facts, ("customer", "product")),
+    Task("maintenance", run_maintenance, ("facts",)),
+    # After every task that writes a core table, so subsets (--only) wait too.
+    Task("local_replica", refresh_local_replica, ("schema", "region", "country", "product_category", "customer", "product", "facts")),
+]
+
+CORE_WRITING_TASKS = {"schema"} | {name for name, tables in TASK_TABLES.items() if set(tables) & set(CORE_TABLES)}
+
+# Shorthands for --only covering several tasks.
+TASK_GROUPS = {
+    "dimensions": ["region", "country", "product_category"],
+    "entities": ["customer", "product"],
+}
+
+
+def analyze_task_tables(conn, task):
+    tables = TASK_TABLES.get(task.name, [])
+    analyze_tables(conn, tables)
+    if task.name == "schema" or set(tables) & set(CORE_TABLES):
+        # The app stops answering from snapshots taken before this.
+        local_replica.mark_loaded(conn)
+
+
+def run_pipeline(db_url, only=None, workers=PIPELINE_WORKERS):
+    """Run the selected tasks, each as soon as its dependencies finish.
+
+    Returns ``(tasks, timings)`` where ``timings`` is a list of
+    ``pipeline.TaskTiming``.
+    """
+    if only:
+        names = set()
+        for name in only:
+            names.update(TASK_GROUPS.get(name, [name]))
+        if names & CORE_WRITING_TASKS:
+            # Otherwise the app would keep serving the old snapshot's answers.
+            names.add("local_replica")
+        tasks = [task for task in TASKS if task.name in names]
+    else:
+        tasks = TASKS
+    timings = run_dag(
+        tasks,
+        lambda: get_connection(db_url),
+        max_workers=workers,
+        on_complete=analyze_task_tables,
+    )
+    return tasks, timings
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Rebuild the customer warehouse from data.csv.")
+    parser.add_argument(
+        "--only",
+        action="append",
+        choices=[task.name for task in TASKS] + list(TASK_GROUPS),
+        help="Run only this task or group; repeat to select several.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=PIPELINE_WORKERS,
+        help="Maximum number of tasks (and connections) running at once.",
+    )
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    tasks, timings = run_pipeline(get_pipeline_db_url(), args.only, args.workers)
+
+    print()
+    print(format_gantt(timings))
+    path, seconds = critical_path(tasks, timings)
+    print(f"Critical path: {' -> '.join(path)} ({seconds:.2f}s)")
 
     print("\n✅ Database migration complete!")
@@ -0,0 +1,169 @@
+"""Approximate previews of aggregate queries over a TABLESAMPLE of the fact table.
+
+``plan_preview`` rewrites an eligible query so the fact table is read through
+``TABLESAMPLE SYSTEM (p)``, scales every SUM/COUNT by ``100 / p`` and adds a
+companion column per aliased aggregate from which a 95% error bound is
+derived. Bounds assume rows are sampled independently; SYSTEM samples whole
+pages, so treat them as indicative rather than exact.
+"""
+import math
+import os
+import re
+from collections import namedtuple
+
+import pandas as pd
+import psycopg2
+from psycopg2 import errors
+
+PREVIEW_SAMPLE_PERCENT = float(os.getenv("PREVIEW_SAMPLE_PERCENT", "2"))
+PREVIEW_BUDGET_MS = int(os.getenv("PREVIEW_BUDGET_MS", "1500"))
+Z_95 = 1.96
+
+# Large tables worth sampling; small dimensions are always read in full.
+SAMPLED_TABLES = ("OrderDetail",)
+
+# Constructs whose result is not a scaled SUM/COUNT of sampled rows.
+_INELIGIBLE = re.compile(
+    r"\b(distinct|having|union|intersect|except|over|min|max|tablesample|left|right|full|with)\b"
+    r"|\(\s*select\b",
+    re.IGNORECASE,
+)
+_AGGREGATE = re.compile(r"\b(sum|count)\s*\(", re.IGNORECASE)
+_ALIAS = re.compile(r"\bas\s+(\w+|\"[^\"]+\")\s*$", re.IGNORECASE)
+
+PreviewPlan = namedtuple("PreviewPlan", ["sql", "percent", "bounds"])
+
+
+def _depths(text):
+    """Yield ``(index, char, depth)`` outside string literals."""
+    depth = 0
+    in_string = False
+    for i, ch in enumerate(text):
+        if in_string:
+            if ch == "'":
+                in_string = False
+            continue
+        if ch == "'":
+            in_string = True
+        elif ch == "(":
+            depth += 1
+        elif ch == ")":
+            depth -= 1
+        yield i, ch, depth
+
+
+def _split_top_level(text):
+    parts, start = [], 0
+    for i, ch, depth in _depths(text):
+        if ch == "," and depth == 0:
+            parts.append(text[start:i])
+            start = i + 1
+    parts.append(text[start:])
+    return parts
+
+
+def _matching_paren(text, open_index):
+    for i, ch, depth in _depths(text[open_index:]):
+        if ch == ")" and depth == 0:
+            return open_index + i
+    raise ValueError("Unbalanced parentheses")
+
+
+def _top_level_from(sql):
+    for match in re.finditer(r"\bfrom\b", sql, re.IGNORECASE):
+        depth = sum(1 if c == "(" else -1 if c == ")" else 0 for c in sql[:match.start()])
+        if depth == 0:
+            return match.start()
+    return None
+
+
+def _scale_item(item, factor):
+    """Scale every SUM/COUNT in a select item; return (item, [(kind, arg)])."""
+    out, found, pos = [], [], 0
+    for match in _AGGREGATE.finditer(item):
+        if match.start() < pos:
+            continue
+        close = _matching_paren(item, match.end() - 1)
+        kind = match.group(1).lower()
+        arg = item[match.end():close]
+        out.append(item[pos:match.start()])
+        out.append(f"({item[match.start():close + 1]} * {factor!r})")
+        found.append((kind, arg.strip()))
+        pos = close + 1
+    out.append(item[pos:])
+    return "".join(out), found
+
+
+def plan_preview(sql, percent=PREVIEW_SAMPLE_PERCENT):
+    """Return a ``PreviewPlan`` for ``sql``, or ``None`` if it is not eligible."""
+    text = sql.strip().rstrip(";").strip()
+    if ";" in text or not re.match(r"select\b", text, re.IGNORECASE) or _INELIGIBLE.search(text):
+        return None
+
+    table_pattern = re.compile(
+        r"\b(from|join)\s+(" + "|".join(SAMPLED_TABLES) + r")\b"
+        r"(\s+(?:as\s+)?(?!(?:on|join|where|group|order|limit|inner|cross|natural|using)\b)\w+)?",
+        re.IGNORECASE,
+    )
+    if len(table_pattern.findall(text)) != 1:
+        return None
+
+    from_index = _top_level_from(text)
+    if from_index is None:
+        return None
+    select_list = text[len("select"):from_index]
+    factor = 100.0 / percent
+
+    items, bounds, extra = [], [], []
+    for item in _split_top_level(select_list):
+        scaled, found = _scale_item(item, factor)
+        items.append(scaled)
+        alias = _ALIAS.search(item.strip())
+        if len(found) == 1 and alias:
+            kind, arg = found[0]
+            name = alias.group(1).strip('"')
+            variance_col = f"__preview_var_{len(bounds)}"
+            if kind == "sum":
+                extra.append(f"SUM((({arg})::float8) ^ 2) AS {variance_col}")
+            else:
+                extra.append(f"COUNT({arg}) AS {variance_col}")
+            bounds.append((name, variance_col))
+    if not any(_AGGREGATE.search(item) for item in items):
+        return None
+
+    rest = table_pattern.sub(
+        lambda m: f"{m.group(0)} TABLESAMPLE SYSTEM ({percent!r})",
+        text[from_index:],
+    )
+    items[-1] = items[-1].rstrip()
+    select = ",".join(items + [f" {e}" for e in extra])
+    return PreviewPlan(f"SELECT{select} {rest}", percent, bounds)
+
+
+def run_preview(conn, plan):
+    """Run a planned preview; ``None`` if it did not fit the latency budget.
+
+    ``conn`` should carry ``statement_timeout = PREVIEW_BUDGET_MS`` so the
+    server enforces the budget.
+    """
+    q = plan.percent / 100.0
+    try:
+        df = pd.read_sql_query(plan.sql, conn)
+    except errors.QueryCanceled:
+        return None
+
+    for name, variance_col in plan.bounds:
+        # Horvitz-Thompson variance under independent sampling at rate q.
+        variance = (1 - q) / (q * q) * df[variance_col].astype(float).fillna(0)
+        df[f"{name} ±95%"] = Z_95 * variance.map(math.sqrt)
+    return df.drop(columns=[col for _, col in plan.bounds])
+
+
+def run_exact(db_url, sql):
+    """Run ``sql`` on its own connection; used for background refinement."""
+    conn = psycopg2.connect(db_url)
+    try:
+        conn.set_session(autocommit=True, readonly=True)
+        return pd.read_sql_query(sql, conn)
+    finally:
+        conn.close()
@@ -0,0 +1,220 @@
+"""Deterministic per-rerun profiler for the Streamlit script.
+
+``RerunProfiler`` installs ``sys.setprofile`` on the script thread for the
+duration of a ``with`` block. It records every call to code in this
+repository plus the first call out of it (``st.markdown``,
+``pd.read_sql_query``, the OpenAI client, ...), so time inside libraries is
+attributed to the library entry point the app called rather than expanded
+into thousands of internal frames.
+
+The result exports as a speedscope evented profile (open it at
+https://www.speedscope.app) and as collapsed stacks for ``flamegraph.pl``.
+"""
+import json
+import os
+import sys
+import time
+from collections import defaultdict
+from pathlib import Path
+
+APP_DIR = str(Path(__file__).resolve().parent) + os.sep
+PROFILE_DIR = Path(os.getenv("PROFILE_DIR", "profiles"))
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "50"))
+SPEEDSCOPE_SCHEMA = "https://www.speedscope.app/file-format-schema.json"
+
+
+def _is_app_code(filename):
+    return filename.startswith(APP_DIR) and "site-packages" not in filename
+
+
+def _python_name(frame):
+    code = frame.f_code
+    qualname = getattr(code, "co_qualname", code.co_name)
+    if _is_app_code(code.co_filename):
+        return qualname
+    return f"{frame.f_globals.get('__name__', '?')}.{qualname}"
+
+
+def _entry_name(frame):
+    """Name for the first library frame the app calls.
+
+    Decorator wrappers (Streamlit's metrics wrapper around every ``st.*``
+    call, ``st.cache_*`` callables) are named after the function they wrap.
+    """
+    code = frame.f_code
+    wrapped = None
+    if code.co_freevars:
+        for var in code.co_freevars:
+            value = frame.f_locals.get(var)
+            if callable(value) and not isinstance(value, type) and hasattr(value, "__qualname__"):
+                wrapped = value
+                break
+    elif code.co_name == "__call__":
+        wrapped = getattr(frame.f_locals.get("self"), "__wrapped__", None)
+    if wrapped is None:
+        return _python_name(frame)
+    return f"{getattr(wrapped, '__module__', '?')}.{wrapped.__qualname__}"
+
+
+def _c_name(func):
+    module = getattr(func, "__module__", None)
+    qualname = getattr(func, "__qualname__", None) or repr(func)
+    return f"{module}.{qualname}" if module else qualname
+
+
+class RerunProfiler:
+    def __init__(self, name="rerun"):
+        self.name = name
+        self.frames = []
+        self.events = []
+        self._frame_ids = {}
+        # One entry per live Python/C call: (recorded frame id or None, is app code).
+        self._stack = []
+        self._start_ns = 0
+        self.duration_ms = 0.0
+
+    def _frame_id(self, name, file, line):
+        key = (name, file, line)
+        frame_id = self._frame_ids.get(key)
+        if frame_id is None:
+            frame_id = self._frame_ids[key] = len(self.frames)
+            self.frames.append({"name": name, "file": file, "line": line})
+        return frame_id
+
+    def _open(self, frame_id, is_app):
+        self._stack.append((frame_id, is_app))
+        if frame_id is not None:
+            self.events.append(("O", frame_id, time.perf_counter_ns() - self._start_ns))
+
+    def _close(self):
+        if not self._stack:
+            # Returning from a frame that started before profiling did.
+            return
+        frame_id, _ = self._stack.pop()
+        if frame_id is not None:
+            self.events.append(("C", frame_id, time.perf_counter_ns() - self._start_ns))
+
+    def _caller_is_app(self):
+        # Frames entered before profiling started are treated as app code.
+        return not self._stack or self._stack[-1][1]
+
+    def _callback(self, frame, event, arg):
+        if event == "call":
+            code = frame.f_code
+            if _is_app_code(code.co_filename):
+                self._open(self._frame_id(_python_name(frame), code.co_filename, code.co_firstlineno), True)
+            elif self._caller_is_app():
+                self._open(self._frame_id(_entry_name(frame), code.co_filename, code.co_firstlineno), False)
+            else:
+                self._open(None, False)
+        elif event == "return":
+            self._close()
+        elif event == "c_call":
+            if self._caller_is_app():
+                self._open(self._frame_id(_c_name(arg), "<built-in>", 0), False)
+            else:
+                self._open(None, False)
+        elif event in ("c_return", "c_exception"):
+            self._close()
+
+    def __enter__(self):
+        self._start_ns = time.perf_counter_ns()
+        sys.setprofile(self._callback)
+        return self
+
+    def __exit__(self, *exc):
+        sys.setprofile(None)
+        # Drop this method and its ``sys.setprofile`` call, the last two opened.
+        for _ in range(2):
+            if self._stack:
+                frame_id, _ = self._stack.pop()
+                if frame_id is not None and self.events and self.events[-1][:2] == ("O", frame_id):
+                    self.events.pop()
+        end = time.perf_counter_ns() - self._start_ns
+        while self._stack:
+            frame_id, _ = self._stack.pop()
+            if frame_id is not None:
+                self.events.append(("C", frame_id, end))
+        self.duration_ms = end / 1e6
+        return False
+
+    def summary(self):
+        """Per-function ``calls``, inclusive and self milliseconds, slowest first."""
+        stats = defaultdict(lambda: {"calls": 0, "total_ms": 0.0, "self_ms": 0.0})
+        open_frames = []
+        depth = defaultdict(int)
+        for kind, frame_id, at in self.events:
+            if kind == "O":
+                open_frames.append([frame_id, at, 0])
+                depth[frame_id] += 1
+                stats[frame_id]["calls"] += 1
+                continue
+            frame_id, opened, child_ns = open_frames.pop()
+            elapsed = at - opened
+            depth[frame_id] -= 1
+            if depth[frame_id] == 0:
+                # Count recursive calls once, at the outermost level.
+                stats[frame_id]["total_ms"] += elapsed / 1e6
+            stats[frame_id]["self_ms"] += (elapsed - child_ns) / 1e6
+            if open_frames:
+                open_frames[-1][2] += elapsed
+        rows = [
+            {
+                "function": self.frames[frame_id]["name"],
+                "calls": s["calls"],
+                "total_ms": round(s["total_ms"], 2),
+                "self_ms": round(s["self_ms"], 2),
+            }
+            for frame_id, s in stats.items()
+        ]
+        return sorted(rows, key=lambda row: row["total_ms"], reverse=True)
+
+    def to_speedscope(self):
+        return {
+            "$schema": SPEEDSCOPE_SCHEMA,
+            "name": self.name,
+            "exporter": "profiler.py",
+            "shared": {"frames": self.frames},
+            "profiles": [
+                {
+                    "type": "evented",
+                    "name": self.name,
+                    "unit": "milliseconds",
+                    "startValue": 0,
+                    "endValue": self.duration_ms,
+                    "events": [
+                        {"type": kind, "frame": frame_id, "at": at / 1e6}
+                        for kind, frame_id, at in self.events
+                    ],
+                }
+            ],
+        }
+
+    def to_collapsed(self):
+        """Brendan Gregg's folded format: ``a;b;c <self microseconds>`` per stack."""
+        weights = defaultdict(int)
+        stack = []
+        last = 0
+        for kind, frame_id, at in self.events:
+            if stack:
+                weights[";".join(self.frames[f]["name"] for f in stack)] += at - last
+            last = at
+            if kind == "O":
+                stack.append(frame_id)
+            else:
+                stack.pop()
+        return "".join(f"{path} {ns // 1000}\n" for path, ns in weights.items() if ns >= 1000)
+
+    def save(self, directory=PROFILE_DIR, keep=PROFILE_KEEP):
+        """Write ``<name>.speedscope.json`` and ``<name>.folded``; returns both paths."""
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        speedscope = directory / f"{self.name}.speedscope.json"
+        collapsed = directory / f"{self.name}.folded"
+        speedscope.write_text(json.dumps(self.to_speedscope()), encoding="utf-8")
+        collapsed.write_text(self.to_collapsed(), encoding="utf-8")
+        profiles = sorted(directory.glob("*.speedscope.json"), key=lambda p: p.stat().st_mtime)
+        for old in profiles[:-keep] if keep else []:
+            old.unlink(missing_ok=True)
+            old.with_name(old.name.replace(".speedscope.json", ".folded")).unlink(missing_ok=True)
+        return speedscope, collapsed
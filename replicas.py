@@ -0,0 +1,191 @@
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+import psycopg2
+from psycopg2 import errors
+
+from admission import ADMISSION_MAX_RUNNING, ConnectionPool
+
+REPLICA_MAX_LAG_S = float(os.getenv("REPLICA_MAX_LAG_S", "30"))
+REPLICA_CHECK_INTERVAL_S = float(os.getenv("REPLICA_CHECK_INTERVAL_S", "5"))
+
+# A replica that has replayed everything it received is not lagging, even if
+# the last replayed transaction is old because the primary is idle. That only
+# holds while it is still receiving: with the WAL receiver disconnected it
+# replays what it has and then looks current forever. Without
+# pg_read_all_stats only the receiver's pid is visible, not its status.
+HEALTH_SQL = """
+    SELECT
+        pg_is_in_recovery(),
+        CASE
+            WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+            ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+        END,
+        (SELECT COUNT(*) FROM pg_stat_activity
+         WHERE state = 'active' AND backend_type = 'client backend' AND pid <> pg_backend_pid()),
+        (SELECT pid FROM pg_stat_wal_receiver),
+        (SELECT status FROM pg_stat_wal_receiver)
+"""
+
+_COMMENTS = re.compile(r"--[^\n]*|/\*.*?\*/", re.DOTALL)
+_STRINGS = re.compile(r"'(?:[^']|'')*'")
+_WRITE_KEYWORDS = re.compile(
+    r"\b(insert|update|delete|merge|create|alter|drop|truncate|grant|revoke|copy|"
+    r"vacuum|analyze|cluster|reindex|lock|call|do|set|reset|into|nextval|setval)\b"
+    r"|\bfor\s+(update|share|no\s+key\s+update|key\s+share)\b",
+    re.IGNORECASE,
+)
+
+
+def is_read_only(sql):
+    """True when ``sql`` is a single plain SELECT (or WITH ... SELECT).
+
+    Deliberately conservative: anything that might write, lock rows or
+    change session state is treated as not read-only.
+    """
+    text = _STRINGS.sub("''", _COMMENTS.sub(" ", sql)).strip().rstrip(";").strip()
+    if not text or ";" in text:
+        return False
+    if not re.match(r"(select|with)\b", text, re.IGNORECASE):
+        return False
+    return _WRITE_KEYWORDS.search(text) is None
+
+
+def describe(url):
+    """Host:port label for a DSN, without credentials."""
+    parts = urlsplit(url)
+    return f"{parts.hostname}:{parts.port or 5432}"
+
+
+class _Replica:
+    def __init__(self, url, pool_size):
+        self.url = url
+        self.name = describe(url)
+        self.pool = ConnectionPool(url, pool_size, readonly=True)
+        # Health checks use their own connection so they never wait behind a query.
+        self.check_conn = None
+        self.check_lock = threading.Lock()
+        self.healthy = False
+        self.lag_s = None
+        self.active = 0
+        self.in_flight = 0
+        self.reason = "not checked"
+
+
+class ReplicaRouter:
+    """Route read-only queries to the least-loaded healthy replica.
+
+    Health (recovery state, WAL streaming, replay lag and active backends) is refreshed at
+    most every ``check_interval_s``. Replicas lagging more than ``max_lag_s``
+    or failing the check are skipped until a later check passes. Each replica
+    has a pool of ``pool_size`` read-only autocommit connections, so admitted
+    queries sent to the same replica run side by side.
+    """
+
+    def __init__(
+        self,
+        urls,
+        max_lag_s=REPLICA_MAX_LAG_S,
+        check_interval_s=REPLICA_CHECK_INTERVAL_S,
+        pool_size=ADMISSION_MAX_RUNNING,
+    ):
+        self.replicas = [_Replica(url, pool_size) for url in urls]
+        self.max_lag_s = max_lag_s
+        self.check_interval_s = check_interval_s
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _mark_down(self, replica, reason):
+        with self._lock:
+            replica.healthy = False
+            replica.reason = reason
+        replica.pool.retire()
+
+    def _health(self, replica):
+        if replica.check_conn is None or replica.check_conn.closed:
+            replica.check_conn = psycopg2.connect(replica.url)
+            replica.check_conn.autocommit = True
+        with replica.check_conn.cursor() as cur:
+            cur.execute(HEALTH_SQL)
+            return cur.fetchone()
+
+    def _check(self, replica):
+        with replica.check_lock:
+            try:
+                in_recovery, lag_s, active, receiver_pid, receiver_status = self._health(replica)
+            except psycopg2.Error as e:
+                if replica.check_conn is not None:
+                    replica.check_conn.close()
+                    replica.check_conn = None
+                self._mark_down(replica, f"unreachable: {str(e).strip()}")
+                return
+        lag_s = float(lag_s)
+        if not in_recovery:
+            healthy, reason = False, "not in recovery"
+        elif receiver_pid is None:
+            healthy, reason = False, "WAL receiver not running"
+        elif receiver_status is not None and receiver_status != "streaming":
+            healthy, reason = False, f"WAL receiver {receiver_status}"
+        elif lag_s > self.max_lag_s:
+            healthy, reason = False, f"lag {lag_s:.1f}s > {self.max_lag_s:.0f}s"
+        else:
+            healthy, reason = True, "ok"
+        with self._lock:
+            replica.lag_s, replica.active = lag_s, active
+            replica.healthy, replica.reason = healthy, reason
+
+    def refresh(self, force=False):
+        # Claim the check under the lock but run it outside, so route() keeps
+        # using the last known health while a slow replica answers.
+        with self._lock:
+            if not force and time.monotonic() - self._checked_at < self.check_interval_s:
+                return
+            self._checked_at = time.monotonic()
+        for replica in self.replicas:
+            self._check(replica)
+
+    def status(self):
+        self.refresh()
+        return [
+            {
+                "replica": r.name,
+                "healthy": r.healthy,
+                "lag_s": r.lag_s,
+                "active": r.active,
+                "in_flight": r.in_flight,
+                "reason": r.reason,
+            }
+            for r in self.replicas
+        ]
+
+    @contextmanager
+    def route(self):
+        """Yield a connection to the best replica, or ``None`` if none qualifies.
+
+        Connection-level failures mark the replica down and are re-raised so
+        the caller can fall back to the primary. A statement timeout is the
+        query's fault, not the replica's, and leaves it in rotation.
+        """
+        self.refresh()
+        with self._lock:
+            candidates = [r for r in self.replicas if r.healthy]
+            replica = min(candidates, key=lambda r: r.active + r.in_flight, default=None)
+            if replica is not None:
+                replica.in_flight += 1
+        if replica is None:
+            yield None
+            return
+        try:
+            with replica.pool.connection() as conn:
+                yield conn
+        except psycopg2.OperationalError as e:
+            if not isinstance(e, errors.QueryCanceled):
+                self._mark_down(replica, f"query failed: {str(e).strip()}")
+            raise
+        finally:
+            with self._lock:
+                replica.in_flight -= 1
@@ -0,0 +1,72 @@
+import pandas as pd
+import pyarrow as pa
+
+# Text columns with at most this share of distinct values become categoricals.
+CATEGORY_MAX_RATIO = 0.5
+
+
+def compact_frame(df, category_max_ratio=CATEGORY_MAX_RATIO):
+    """Return a memory-compact copy of a query result.
+
+    Low-cardinality text columns become ``category``, integers are downcast
+    to the smallest type that holds them, and floats drop to ``float32``
+    only when that round-trips every value exactly.
+    """
+    out = df.copy(deep=False)
+    rows = len(out)
+    for index in range(out.shape[1]):
+        column = out.iloc[:, index]
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            continue
+        if pd.api.types.is_bool_dtype(column):
+            continue
+        if pd.api.types.is_integer_dtype(column):
+            out.isetitem(index, pd.to_numeric(column, downcast="integer"))
+        elif pd.api.types.is_float_dtype(column):
+            narrowed = column.astype("float32")
+            if narrowed.astype(column.dtype).equals(column):
+                out.isetitem(index, narrowed)
+        elif rows and (column.dtype == object or pd.api.types.is_string_dtype(column)):
+            values = column.dropna()
+            if values.empty:
+                continue
+            if column.dtype == object and not values.map(lambda v: isinstance(v, str)).all():
+                continue
+            if column.nunique(dropna=True) <= rows * category_max_ratio:
+                out.isetitem(index, column.astype("category"))
+    return out
+
+
+def to_arrow(df):
+    """Convert once to the Arrow table ``st.dataframe`` renders from.
+
+    Duplicate column names (e.g. two unaliased ``count`` columns) get a
+    numeric suffix, since Arrow cannot address them otherwise. Object columns
+    Arrow cannot type, such as json values mixing objects, lists and numbers,
+    are shown as text, as ``st.dataframe`` does for a DataFrame.
+    """
+    seen = {}
+    names = []
+    for name in map(str, df.columns):
+        seen[name] = seen.get(name, 0) + 1
+        names.append(name if seen[name] == 1 else f"{name}_{seen[name]}")
+    frame = df.set_axis(names, axis=1)
+    try:
+        return pa.Table.from_pandas(frame, preserve_index=False)
+    except pa.ArrowException:
+        pass
+    frame = frame.copy(deep=False)
+    for index in range(len(names)):
+        column = frame.iloc[:, index]
+        if column.dtype != object:
+            continue
+        try:
+            pa.array(column, from_pandas=True)
+        except pa.ArrowException:
+            frame.isetitem(index, column.astype("string"))
+    return pa.Table.from_pandas(frame, preserve_index=False)
+
+
+def page(table, page_number, page_rows):
+    """Zero-copy slice of ``table`` for a 1-based page number."""
+    return table.slice((page_number - 1) * page_rows, page_rows)
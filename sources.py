@@ -0,0 +1,110 @@
+"""Input streams for the staging loader.
+
+``open_text`` reads gzip, bz2 and zstd exports as streams (no decompressing
+to disk first) and memory-maps plain files, counting bytes on both sides of
+the decoder so the loader can report input and decompressed throughput.
+zstd needs the optional ``zstandard`` package.
+"""
+import bz2
+import gzip
+import io
+import mmap
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+READ_BUFFER_BYTES = 1 << 20
+
+CODECS = {".gz": "gzip", ".bz2": "bz2", ".zst": "zstd"}
+
+
+class InputStats:
+    def __init__(self, path, codec):
+        self.path = path
+        self.codec = codec
+        self.input_bytes = 0
+        self.output_bytes = 0
+
+    def describe(self, elapsed_s):
+        elapsed_s = max(elapsed_s, 1e-9)
+        text = f"{self.path.name} ({self.codec}): {self.input_bytes / 1e6:,.1f} MB read at {self.input_bytes / elapsed_s / 1e6:,.1f} MB/s"
+        if self.codec != "plain":
+            text += f", {self.output_bytes / 1e6:,.1f} MB decompressed at {self.output_bytes / elapsed_s / 1e6:,.1f} MB/s"
+        return text
+
+
+class _CountingReader(io.RawIOBase):
+    """Raw stream over ``source`` adding the bytes it returns to ``stats.<field>``."""
+
+    def __init__(self, source, stats, field):
+        self.source = source
+        self.stats = stats
+        self.field = field
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        data = self.source.read(len(b))
+        n = len(data)
+        b[:n] = data
+        setattr(self.stats, self.field, getattr(self.stats, self.field) + n)
+        return n
+
+
+def resolve_input(filename):
+    """``filename`` if it exists, else the first compressed variant that does."""
+    path = Path(filename)
+    if path.exists():
+        return path
+    for suffix in CODECS:
+        candidate = path.with_name(path.name + suffix)
+        if candidate.exists():
+            return candidate
+    return None
+
+
+def _decoder(codec, stream):
+    if codec == "gzip":
+        return gzip.GzipFile(fileobj=stream, mode="rb")
+    if codec == "bz2":
+        return bz2.BZ2File(stream, mode="rb")
+    if zstandard is None:
+        raise RuntimeError("Reading .zst input needs the zstandard package (pip install zstandard)")
+    return zstandard.ZstdDecompressor().stream_reader(stream, read_size=READ_BUFFER_BYTES)
+
+
+@contextmanager
+def open_text(filepath, encoding="utf-8-sig", errors="strict"):
+    """Yield ``(text_stream, stats)`` for a plain or compressed file."""
+    path = Path(filepath)
+    codec = CODECS.get(path.suffix.lower(), "plain")
+    stats = InputStats(path, codec)
+    with path.open("rb") as raw:
+        mapped = decoder = None
+        if codec == "plain":
+            if path.stat().st_size:
+                mapped = mmap.mmap(raw.fileno(), 0, access=mmap.ACCESS_READ)
+                if hasattr(mapped, "madvise"):
+                    mapped.madvise(mmap.MADV_SEQUENTIAL)
+            source = _CountingReader(mapped if mapped is not None else raw, stats, "input_bytes")
+        else:
+            compressed = io.BufferedReader(_CountingReader(raw, stats, "input_bytes"), READ_BUFFER_BYTES)
+            decoder = _decoder(codec, compressed)
+            source = _CountingReader(decoder, stats, "output_bytes")
+        try:
+            text = io.TextIOWrapper(
+                io.BufferedReader(source, READ_BUFFER_BYTES), encoding=encoding, errors=errors, newline=""
+            )
+            yield text, stats
+        finally:
+            if codec == "plain":
+                stats.output_bytes = stats.input_bytes
+            if decoder is not None:
+                decoder.close()
+            if mapped is not None:
+                mapped.close()
@@ -0,0 +1,96 @@
+import re
+
+MODEL = "gpt-4o-mini"
+
+# ---------- SCHEMA CONTEXT FOR GPT ----------
+
+DATABASE_SCHEMA = """
+Database Schema:
+
+LOOKUP / DIMENSIONS:
+- Region(RegionID SERIAL PRIMARY KEY, Region TEXT UNIQUE)
+- Country(CountryID SERIAL PRIMARY KEY, Country TEXT UNIQUE, RegionID INTEGER FK -> Region)
+- ProductCategory(ProductCategoryID SERIAL PRIMARY KEY, ProductCategory TEXT UNIQUE, ProductCategoryDescription TEXT)
+- Product(ProductID SERIAL PRIMARY KEY, ProductName TEXT UNIQUE, ProductUnitPrice REAL, ProductCategoryID INTEGER FK -> ProductCategory)
+
+CORE TABLES:
+- Customer(CustomerID SERIAL PRIMARY KEY, FirstName TEXT, LastName TEXT, Address TEXT, City TEXT, CountryID INTEGER FK -> Country)
+- OrderDetail(OrderID SERIAL PRIMARY KEY, CustomerID INTEGER FK -> Customer, ProductID INTEGER FK -> Product, OrderDate DATE, QuantityOrdered INTEGER)
+
+Helpful joins:
+- Country joins Region via Country.RegionID
+- Customer joins Country via Customer.CountryID
+- OrderDetail joins Customer and Product via their IDs
+- Product joins ProductCategory via ProductCategoryID
+
+Common calculations:
+- Total revenue: SUM(QuantityOrdered * ProductUnitPrice)
+- Order counts: COUNT(DISTINCT OrderID) or COUNT(*)
+- Date filters: OrderDate is a DATE column
+"""
+
+SYSTEM_PROMPT = "You are a PostgreSQL expert who generates accurate SQL queries based on natural language questions."
+
+
+def build_prompt(user_question):
+    return f"""You are a PostgreSQL expert. Given the following database schema and a user's question, generate a valid PostgreSQL query.
+
+{DATABASE_SCHEMA}
+
+User Question: {user_question}
+
+Requirements:
+1. Generate ONLY the SQL query that I can directly use. No other response.
+2. Use proper JOINs to get descriptive names from lookup tables
+3. Use appropriate aggregations (COUNT, AVG, SUM, etc.) when needed
+4. Add LIMIT clauses for queries that might return many rows (default LIMIT 100)
+5. Use proper date/time functions for TIMESTAMP or DATE columns
+6. Make sure the query is syntactically correct for PostgreSQL
+7. Add helpful column aliases using AS
+
+Generate the SQL query:"""
+
+
+def extract_sql_from_response(response_text: str) -> str:
+    """
+    Take the model response and return *only* the SQL query:
+    - Strip ```sql ... ``` fences if present
+    - Remove a leading 'sql ' prefix if it exists
+    """
+    # Remove fenced code block markers like ```sql ... ```
+    text = re.sub(r"```sql\s*|\s*```", "", response_text,
+                  flags=re.IGNORECASE).strip()
+
+    # Safety: if it still starts with 'sql ' (no backticks), drop that
+    if text.lower().startswith("sql "):
+        text = text[4:].lstrip()
+
+    return text
+
+
+def generate_sql(client, user_question):
+    """Ask the model for a query answering ``user_question``; API errors propagate."""
+    response = client.chat.completions.create(
+        model=MODEL,
+        messages=[
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": build_prompt(user_question)},
+        ],
+        temperature=0.1,
+        max_tokens=1000,
+    )
+    return extract_sql_from_response(response.choices[0].message.content)
+
+
+def ensure_limit(sql: str, default_limit: int) -> str:
+    """
+    Append a LIMIT if one is not present to keep queries fast/safe.
+    Avoids adding a second LIMIT if the query already has one.
+    """
+    pattern = re.compile(r"\blimit\b", re.IGNORECASE)
+    if pattern.search(sql):
+        # Already has LIMIT somewhere
+        return sql.strip()
+
+    stripped = sql.strip().rstrip(";")
+    return f"{stripped} LIMIT {default_limit}"
@@ -1,27 +1,42 @@
-import re
+import threading
+import time
+from pathlib import Path
+
 import streamlit as st
-import pandas as pd
-import psycopg2
 from dotenv import load_dotenv
-from openai import OpenAI
-import bcrypt
 
-load_dotenv()
+import auth
+from sql_generation import (  # noqa: F401 - DATABASE_SCHEMA/extract_sql_from_response re-exported
+    DATABASE_SCHEMA,
+    ensure_limit,
+    extract_sql_from_response,
+    generate_sql,
+)
+from utils import with_session_options
 
-OPENAI_API_KEY = st.secrets["OPENAI_API_KEY"]
-HASHED_PASSWORD = st.secrets["HASHED_PASSWORD"].encode("utf-8")
+# pandas, psycopg2 and openai are imported where they are first used so the
+# login screen renders without paying for them; see _warm_heavy_modules.
+
+load_dotenv()
 
 QUERY_DEFAULT_LIMIT = 500
 STATEMENT_TIMEOUT_MS = 15_000
 LOCK_TIMEOUT_MS = 3_000
 CONNECT_TIMEOUT_S = 5
+PREVIEW_REFINEMENT_WORKERS = 2
+# Rows st.dataframe serializes per rerun; larger results are paged.
+RENDER_MAX_ROWS = 2_000
+HISTORY_PANEL_ENTRIES = 8
+PLANNER_CONNECTIONS = 2
+# Reverse proxies in front of the app that append to X-Forwarded-For.
+TRUSTED_PROXY_HOPS = 1
 
 # ---------- PAGE CONFIG & GLOBAL STYLES ----------
 
 st.set_page_config(page_title="Aurora Query Studio", page_icon="🧭", layout="wide")
 
-st.markdown(
-    """
+
+GLOBAL_STYLES = """
     <style>
         @import url('https://fonts.googleapis.com/css2?family=SF+Pro+Display:wght@400;500;600;700&family=Inter:wght@400;500;600;700&display=swap');
 
@@ -298,36 +313,11 @@ st.markdown(
             font-size: 13px !important;
         }
     </style>
-    """,
-    unsafe_allow_html=True,
-)
-
-# ---------- SCHEMA CONTEXT FOR GPT ----------
-
-DATABASE_SCHEMA = """
-Database Schema:
-
-LOOKUP / DIMENSIONS:
-- Region(RegionID SERIAL PRIMARY KEY, Region TEXT UNIQUE)
-- Country(CountryID SERIAL PRIMARY KEY, Country TEXT UNIQUE, RegionID INTEGER FK -> Region)
-- ProductCategory(ProductCategoryID SERIAL PRIMARY KEY, ProductCategory TEXT UNIQUE, ProductCategoryDescription TEXT)
-- Product(ProductID SERIAL PRIMARY KEY, ProductName TEXT UNIQUE, ProductUnitPrice REAL, ProductCategoryID INTEGER FK -> ProductCategory)
-
-CORE TABLES:
-- Customer(CustomerID SERIAL PRIMARY KEY, FirstName TEXT, LastName TEXT, Address TEXT, City TEXT, CountryID INTEGER FK -> Country)
-- OrderDetail(OrderID SERIAL PRIMARY KEY, CustomerID INTEGER FK -> Customer, ProductID INTEGER FK -> Product, OrderDate DATE, QuantityOrdered INTEGER)
+    """
 
-Helpful joins:
-- Country joins Region via Country.RegionID
-- Customer joins Country via Customer.CountryID
-- OrderDetail joins Customer and Product via their IDs
-- Product joins ProductCategory via ProductCategoryID
 
-Common calculations:
-- Total revenue: SUM(QuantityOrdered * ProductUnitPrice)
-- Order counts: COUNT(DISTINCT OrderID) or COUNT(*)
-- Date filters: OrderDate is a DATE column
-"""
+def inject_styles():
+    st.markdown(GLOBAL_STYLES, unsafe_allow_html=True)
 
 # ---------- AUTH / LOGIN ----------
 
@@ -374,145 +364,654 @@ def login_screen():
         st.markdown("</div>", unsafe_allow_html=True)
 
     if login_btn:
-        if password:
+        client = _client_key()
+        limiter = get_login_limiter()
+        wait_s = limiter.retry_after(client)
+        if wait_s:
+            st.error(f"❌ Too many failed attempts. Try again in {int(wait_s) + 1}s.")
+        elif password:
             try:
-                if bcrypt.checkpw(password.encode("utf-8"), HASHED_PASSWORD):
+                hashed_password = st.secrets["HASHED_PASSWORD"].encode("utf-8")
+                if get_password_verifier().verify(password.encode("utf-8"), hashed_password):
+                    limiter.reset(client)
+                    token = auth.issue_session_token(_session_secret())
+                    st.query_params["session"] = token
+                    st.session_state.session_token = token
                     st.session_state.logged_in = True
                     st.success("✅ Authentication successful. Loading workspace…")
                     st.rerun()
                 else:
+                    limiter.record_failure(client)
                     st.error("❌ Incorrect password")
+            except auth.LoginBusy:
+                st.warning("⏳ Sign-in is busy right now. Please try again in a moment.")
             except Exception as e:
                 st.error(f"❌ Authentication error: {e}")
         else:
             st.warning("⚠️ Please enter a password")
 
-    st.caption("Passwords are verified with bcrypt. Close the tab or click Logout to end the session.")
+    st.caption("Passwords are verified with bcrypt. Click Logout to end the session; the page URL signs you in until then.")
+
+
+@st.cache_resource
+def get_password_verifier():
+    return auth.PasswordVerifier()
+
+
+@st.cache_resource
+def get_login_limiter():
+    return auth.AttemptLimiter()
+
+
+@st.cache_resource
+def get_revoked_tokens():
+    return auth.RevokedTokens()
+
+
+def _client_key():
+    """
+    Client address for the login limiter. Clients can send any
+    X-Forwarded-For they like; only the entries appended by our own proxies
+    are trustworthy, so take the one TRUSTED_PROXY_HOPS from the end.
+    """
+    hops = int(st.secrets.get("TRUSTED_PROXY_HOPS", TRUSTED_PROXY_HOPS))
+    forwarded = [hop.strip() for hop in st.context.headers.get("X-Forwarded-For", "").split(",") if hop.strip()]
+    if hops and len(forwarded) >= hops:
+        return forwarded[-hops]
+    ip_address = getattr(st.context, "ip_address", None)
+    return ip_address if isinstance(ip_address, str) else "unknown"
+
+
+def _session_secret():
+    # Falling back to the password hash means rotating the password also
+    # invalidates every outstanding session token.
+    return st.secrets.get("SESSION_SECRET", st.secrets["HASHED_PASSWORD"]).encode("utf-8")
 
 
 def require_login():
-    if "logged_in" not in st.session_state or not st.session_state.logged_in:
+    if not st.session_state.get("logged_in"):
+        token = st.query_params.get("session")
+        if token and auth.verify_session_token(token, _session_secret(), get_revoked_tokens()):
+            st.session_state.session_token = token
+            st.session_state.logged_in = True
+    if not st.session_state.get("logged_in"):
         login_screen()
         st.stop()
+    _warm_heavy_modules()
+
+
+def _import_heavy_modules():
+    import pandas  # noqa: F401
+    import psycopg2  # noqa: F401
+    import openai  # noqa: F401
 
-# ---------- DB HELPERS ----------
 
 @st.cache_resource
-def get_db_url():
+def _warm_heavy_modules():
+    """Start importing the query-path modules in the background, once per process."""
+    thread = threading.Thread(target=_import_heavy_modules, name="warm-imports", daemon=True)
+    thread.start()
+    return thread
+
+# ---------- DB HELPERS ----------
+
+def _base_db_url():
     POSTGRES_USERNAME = st.secrets["POSTGRES_USERNAME"]
     POSTGRES_PASSWORD = st.secrets["POSTGRES_PASSWORD"]
     POSTGRES_SERVER = st.secrets["POSTGRES_SERVER"]
     POSTGRES_DATABASE = st.secrets["POSTGRES_DATABASE"]
     return f"postgresql://{POSTGRES_USERNAME}:{POSTGRES_PASSWORD}@{POSTGRES_SERVER}/{POSTGRES_DATABASE}"
 
-DATABASE_URL = get_db_url()
+@st.cache_resource
+def get_db_url():
+    return _with_session_options(_base_db_url())
+
+def _with_session_options(url, statement_timeout_ms=STATEMENT_TIMEOUT_MS):
+    # Session timeouts travel as libpq options instead of SET round trips.
+    return with_session_options(
+        url,
+        CONNECT_TIMEOUT_S,
+        statement_timeout=statement_timeout_ms,
+        lock_timeout=LOCK_TIMEOUT_MS,
+        idle_in_transaction_session_timeout=LOCK_TIMEOUT_MS * 10,
+    )
+
+@st.cache_resource
+def get_replica_router():
+    """Router over the optional POSTGRES_REPLICA_URLS secret (list or comma-separated)."""
+    urls = st.secrets.get("POSTGRES_REPLICA_URLS", [])
+    if isinstance(urls, str):
+        urls = [url.strip() for url in urls.split(",") if url.strip()]
+    if not urls:
+        return None
+    from replicas import ReplicaRouter
+
+    return ReplicaRouter(
+        [_with_session_options(url) for url in urls], pool_size=get_admission_controller().max_running
+    )
+
+@st.cache_resource
+def get_query_pool():
+    """One primary connection per admission slot, so admitted queries run side by side."""
+    from admission import ConnectionPool
+
+    return ConnectionPool(get_db_url(), get_admission_controller().max_running)
 
 @st.cache_resource
-def get_db_connection():
+def get_planner_pool():
+    """Connections for EXPLAIN, never held by a running query."""
+    from admission import ConnectionPool
+
+    return ConnectionPool(get_db_url(), PLANNER_CONNECTIONS)
+
+@st.cache_resource
+def get_local_replica():
+    """DuckDB snapshot written by populate_db, or None when disabled or missing."""
+    from local_replica import LOCAL_REPLICA_PATH, LocalReplica
+
+    path = st.secrets.get("LOCAL_REPLICA_PATH", LOCAL_REPLICA_PATH)
+    if not path:
+        return None
+    return LocalReplica(path, current_version=_warehouse_version, timeout_s=STATEMENT_TIMEOUT_MS / 1000)
+
+def _warehouse_version():
+    from local_replica import warehouse_version
+
+    with get_planner_pool().connection() as conn:
+        return warehouse_version(conn)
+
+@st.cache_resource
+def get_history_store():
+    """Shared query history, or None when disabled with an empty HISTORY_PATH."""
+    from history import HISTORY_PATH, HistoryStore
+
+    path = st.secrets.get("HISTORY_PATH", HISTORY_PATH)
+    if not path:
+        return None
     try:
-        conn = psycopg2.connect(DATABASE_URL, connect_timeout=CONNECT_TIMEOUT_S)
-        conn.set_session(autocommit=True)
-        with conn.cursor() as cur:
-            cur.execute("SET statement_timeout = %s;", (STATEMENT_TIMEOUT_MS,))
-            cur.execute("SET lock_timeout = %s;", (LOCK_TIMEOUT_MS,))
-            cur.execute(
-                "SET idle_in_transaction_session_timeout = %s;",
-                (LOCK_TIMEOUT_MS * 10,),
-            )
-        return conn
+        return HistoryStore(path)
     except Exception as e:
-        st.error(f"Failed to connect to database: {e}")
+        st.warning(f"Query history unavailable: {e}")
         return None
 
+@st.cache_resource
+def get_admission_controller():
+    from admission import AdmissionController
+
+    return AdmissionController()
+
+def _session_id():
+    if "admission_id" not in st.session_state:
+        import uuid
+
+        st.session_state.admission_id = uuid.uuid4().hex
+    return st.session_state.admission_id
+
 def _ensure_limit(sql: str, default_limit: int = QUERY_DEFAULT_LIMIT) -> str:
-    """
-    Append a LIMIT if one is not present to keep queries fast/safe.
-    Avoids adding a second LIMIT if the query already has one.
-    """
-    pattern = re.compile(r"\blimit\b", re.IGNORECASE)
-    if pattern.search(sql):
-        # Already has LIMIT somewhere
-        return sql.strip()
+    return ensure_limit(sql, default_limit)
 
-    stripped = sql.strip().rstrip(";")
-    return f"{stripped} LIMIT {default_limit}"
+def _run_on_replica(safe_sql):
+    """Run a read-only query on a healthy replica; ``None`` means use the primary."""
+    import pandas as pd
+    import psycopg2
 
-def run_query(sql):
-    conn = get_db_connection()
-    if conn is None:
+    from replicas import is_read_only
+
+    router = get_replica_router()
+    if router is None or not is_read_only(safe_sql):
         return None
+    try:
+        with router.route() as conn:
+            if conn is None:
+                return None
+            return pd.read_sql_query(safe_sql, conn)
+    except psycopg2.OperationalError as e:
+        st.warning(f"Replica unavailable, running on primary instead: {e}")
+        return None
+
+def _run_locally(safe_sql):
+    """Answer from the local DuckDB snapshot; ``None`` means ask PostgreSQL."""
+    local = get_local_replica()
+    if local is None:
+        return None
+    start = time.perf_counter()
+    df = local.query(safe_sql)
+    if df is not None:
+        st.caption(f"⚡ Answered from the local snapshot in {(time.perf_counter() - start) * 1000:.0f} ms")
+    return df
+
+def _run_admitted(safe_sql):
+    """Queue for a warehouse slot by EXPLAIN cost, then run on a replica or the primary."""
+    import pandas as pd
+    import psycopg2
+
+    from admission import ADMISSION_DEFAULT_COST, estimate_cost
+
+    try:
+        with get_planner_pool().connection() as conn:
+            cost = estimate_cost(conn, safe_sql)
+    except psycopg2.Error:
+        # Not every statement can be EXPLAINed; let it run and report its own errors.
+        cost = ADMISSION_DEFAULT_COST
+    status = st.empty()
+
+    def on_wait(position, waited_s):
+        place = "next in line" if position == 0 else f"{position} ahead of you"
+        status.info(f"⏳ Queued for the warehouse ({place}) · waited {waited_s:.1f}s · estimated cost {cost:,.0f}")
+
+    with get_admission_controller().admit(_session_id(), cost, on_wait) as waited_s:
+        status.empty()
+        if waited_s >= 0.5:
+            st.caption(f"Waited {waited_s:.1f}s in the query queue")
+        df = _run_on_replica(safe_sql)
+        if df is None:
+            with get_query_pool().connection() as conn:
+                df = pd.read_sql_query(safe_sql, conn)
+    return df
+
+def run_query(sql):
+    from admission import AdmissionTimeout, QueueFull
+    from results import compact_frame
+
     safe_sql = _ensure_limit(sql)
     if safe_sql != sql:
         st.info(f"Added LIMIT {QUERY_DEFAULT_LIMIT} to keep the query responsive.")
     try:
-        df = pd.read_sql_query(safe_sql, conn)
-        return df
+        df = _run_locally(safe_sql)
+        if df is None:
+            df = _run_admitted(safe_sql)
+        if df is None:
+            return None
+        return compact_frame(df)
+    except (QueueFull, AdmissionTimeout) as e:
+        st.warning(f"The warehouse is busy ({e}). Please try again shortly.")
+        return None
     except Exception as e:
         st.error(f"Error executing query: {e}")
         return None
 
-# ---------- OPENAI HELPERS ----------
+# ---------- FAST PREVIEW ----------
 
 @st.cache_resource
-def get_openai_client():
-    return OpenAI(api_key=OPENAI_API_KEY)
+def get_preview_pool():
+    """Read-only connections whose statement_timeout is the preview latency budget.
 
-def extract_sql_from_response(response_text: str) -> str:
+    Sized like the query pool, so concurrent previews do not queue behind
+    each other; a broken connection is replaced on the next preview.
     """
-    Take the model response and return *only* the SQL query:
-    - Strip ```sql ... ``` fences if present
-    - Remove a leading 'sql ' prefix if it exists
-    """
-    # Remove fenced code block markers like ```sql ... ```
-    text = re.sub(r"```sql\s*|\s*```", "", response_text,
-                  flags=re.IGNORECASE).strip()
+    from admission import ConnectionPool
+    from preview import PREVIEW_BUDGET_MS
 
-    # Safety: if it still starts with 'sql ' (no backticks), drop that
-    if text.lower().startswith("sql "):
-        text = text[4:].lstrip()
+    return ConnectionPool(
+        _with_session_options(_base_db_url(), PREVIEW_BUDGET_MS),
+        get_admission_controller().max_running,
+        readonly=True,
+    )
 
-    return text
+@st.cache_resource
+def get_refinement_executor():
+    from concurrent.futures import ThreadPoolExecutor
 
-def generate_sql_with_gpt(user_question):
-    client = get_openai_client()
-    prompt = f"""You are a PostgreSQL expert. Given the following database schema and a user's question, generate a valid PostgreSQL query.
+    return ThreadPoolExecutor(max_workers=PREVIEW_REFINEMENT_WORKERS, thread_name_prefix="refine")
 
-{DATABASE_SCHEMA}
+def _run_exact_admitted(controller, session_id, cost, db_url, sql):
+    """Background refinement; queues like an interactive query, without UI updates."""
+    from preview import run_exact
 
-User Question: {user_question}
+    with controller.admit(session_id, cost):
+        return run_exact(db_url, sql)
 
-Requirements:
-1. Generate ONLY the SQL query that I can directly use. No other response.
-2. Use proper JOINs to get descriptive names from lookup tables
-3. Use appropriate aggregations (COUNT, AVG, SUM, etc.) when needed
-4. Add LIMIT clauses for queries that might return many rows (default LIMIT 100)
-5. Use proper date/time functions for TIMESTAMP or DATE columns
-6. Make sure the query is syntactically correct for PostgreSQL
-7. Add helpful column aliases using AS
+def start_preview(sql):
+    """
+    Run a sampled preview of an aggregate query and start the exact query in
+    the background. Returns (df, plan, future), or None when the query is not
+    eligible or the preview did not fit its budget.
+    """
+    from admission import estimate_cost
+    from preview import plan_preview, run_preview
+    from results import compact_frame
 
-Generate the SQL query:"""
+    safe_sql = _ensure_limit(sql)
+    plan = plan_preview(safe_sql)
+    if plan is None:
+        return None
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are a PostgreSQL expert who generates accurate SQL queries based on natural language questions.",
-                },
-                {"role": "user", "content": prompt},
-            ],
-            temperature=0.1,
-            max_tokens=1000,
+        with get_preview_pool().connection() as conn:
+            df = run_preview(conn, plan)
+    except Exception as e:
+        st.warning(f"Preview failed, running the exact query instead: {e}")
+        return None
+    if df is None:
+        return None
+    try:
+        with get_planner_pool().connection() as planner:
+            cost = estimate_cost(planner, safe_sql)
+    except Exception:
+        cost = float("inf")
+    future = get_refinement_executor().submit(
+        _run_exact_admitted, get_admission_controller(), _session_id(), cost, get_db_url(), safe_sql
+    )
+    return compact_frame(df), plan, future
+
+@st.fragment(run_every=1.0)
+def watch_refinement():
+    """Poll the background exact query and swap it in once it finishes."""
+    result = st.session_state.last_result
+    future = result.get("refinement")
+    if future is None:
+        return
+    if not future.done():
+        st.caption(
+            f"⏳ Estimates from a ~{result['preview_percent']:g}% sample. "
+            "Exact results are computing in the background…"
         )
-        sql_query = extract_sql_from_response(response.choices[0].message.content)
-        return sql_query
+        return
+    from results import compact_frame
+
+    try:
+        refined = make_result(compact_frame(future.result()), result["sql"], history_id=result.get("history_id"))
+    except Exception as e:
+        result["refinement"] = None
+        result["refinement_error"] = str(e)
+        st.rerun()
+    st.session_state.last_result = refined
+    update_history(st.session_state.last_result)
+    st.rerun()
+
+# ---------- RESULTS ----------
+
+def make_result(df, sql, **extra):
+    """
+    Keep a result as an Arrow table only: it is what st.dataframe renders
+    from, so reruns skip the pandas-to-Arrow conversion and the session holds
+    a single copy of the data.
+
+    st.dataframe still writes the table out as Arrow IPC bytes on every rerun
+    and has no way to accept bytes serialized earlier, so that cost is bounded
+    instead: at most RENDER_MAX_ROWS rows are rendered per rerun.
+    """
+    from results import to_arrow
+
+    return {"table": to_arrow(df), "rows": len(df), "sql": sql, **extra}
+
+def render_last_result():
+    from results import page
+
+    result = st.session_state.last_result
+    rows = result["rows"]
+    if result.get("recalled_at"):
+        st.info(f"🕘 Saved result from {result['recalled_at']}: {rows} rows, not re-run")
+    elif result.get("refinement") is not None:
+        st.info(f"⚡ Preview: {rows} rows of scaled estimates with ±95% bounds")
+        watch_refinement()
+    elif result.get("preview_percent"):
+        st.info(f"⚡ Preview only: {rows} rows of scaled estimates")
+        if result.get("refinement_error"):
+            st.warning(f"Exact query failed; keeping the preview: {result['refinement_error']}")
+    else:
+        st.success(f"✅ Query returned {rows} rows")
+
+    table = result["table"]
+    if rows <= RENDER_MAX_ROWS:
+        st.dataframe(table, use_container_width=True)
+        return
+    pages = -(-rows // RENDER_MAX_ROWS)
+    page_number = st.number_input("Result page", min_value=1, max_value=pages, value=1, key="result_page")
+    first = (page_number - 1) * RENDER_MAX_ROWS
+    st.caption(f"Showing rows {first + 1:,}–{min(first + RENDER_MAX_ROWS, rows):,} of {rows:,}")
+    st.dataframe(page(table, page_number, RENDER_MAX_ROWS), use_container_width=True)
+
+# ---------- QUERY HISTORY ----------
+
+def record_history(result, question, generate_ms, run_ms):
+    """Save a new result to the history store and remember its entry id."""
+    store = get_history_store()
+    if store is None:
+        return
+    try:
+        result["history_id"] = store.add(
+            question,
+            result["sql"],
+            result["table"],
+            generate_ms=generate_ms,
+            run_ms=run_ms,
+            preview=result.get("refinement") is not None,
+        )
+    except Exception as e:
+        st.warning(f"Could not save this query to history: {e}")
+
+def update_history(result):
+    """Replace a preview's saved snapshot with the exact result."""
+    store = get_history_store()
+    if store is None or result.get("history_id") is None:
+        return
+    try:
+        store.replace_result(result["history_id"], result["table"])
+    except Exception as e:
+        st.warning(f"Could not update query history: {e}")
+
+def recall_history(entry_id):
+    """Button callback: restore a saved result without calling the LLM or the warehouse."""
+    entry, table = get_history_store().load(entry_id)
+    if entry is None:
+        st.session_state.history_notice = "That history entry no longer exists."
+        return
+    st.session_state.current_question = entry["question"]
+    st.session_state.generated_sql = entry["sql"]
+    st.session_state.pop("result_page", None)
+    if table is None:
+        st.session_state.last_result = None
+        st.session_state.history_notice = "No saved result for that entry (too large to keep). Run the SQL again."
+        return
+    st.session_state.last_result = {
+        "table": table,
+        "rows": table.num_rows,
+        "sql": entry["sql"],
+        "history_id": entry["id"],
+        "recalled_at": time.strftime("%Y-%m-%d %H:%M", time.localtime(entry["created_at"])),
+    }
+
+def _format_ms(ms):
+    if ms is None:
+        return "–"
+    return f"{ms / 1000:.1f}s" if ms >= 1000 else f"{ms:.0f} ms"
+
+def history_panel():
+    store = get_history_store()
+    if store is None:
+        return
+    st.markdown("<div class='section-title' style='margin-top:0.6rem;'>Query history</div>", unsafe_allow_html=True)
+    text = st.text_input(
+        "Search history",
+        key="history_search",
+        placeholder="e.g. revenue country",
+        label_visibility="collapsed",
+    )
+    if "history_notice" in st.session_state:
+        st.warning(st.session_state.pop("history_notice"))
+    try:
+        entries = store.search(text, limit=HISTORY_PANEL_ENTRIES)
+    except Exception as e:
+        st.warning(f"Query history unavailable: {e}")
+        return
+    if not entries:
+        st.caption("No matching queries yet." if text.strip() else "Answered questions will appear here.")
+        return
+    for entry in entries:
+        when = time.strftime("%Y-%m-%d %H:%M", time.localtime(entry["created_at"]))
+        st.markdown(f"**{entry['question'] or 'Edited SQL'}**")
+        details = [when, f"{entry['rows']:,} rows" if entry["rows"] is not None else "no rows"]
+        details.append(f"SQL {_format_ms(entry['generate_ms'])} · query {_format_ms(entry['run_ms'])}")
+        if entry["preview"]:
+            details.append("preview")
+        if entry["snapshot_bytes"] is None:
+            details.append("no saved result")
+        st.caption(" · ".join(details))
+        with st.expander("SQL"):
+            st.code(entry["sql"], language="sql")
+        st.button(
+            "↩️ Open result",
+            key=f"history_open_{entry['id']}",
+            on_click=recall_history,
+            args=(entry["id"],),
+            disabled=entry["snapshot_bytes"] is None,
+            use_container_width=True,
+        )
+
+# ---------- OPENAI HELPERS ----------
+
+@st.cache_resource
+def get_openai_client():
+    from openai import OpenAI
+
+    return OpenAI(
+        api_key=st.secrets["OPENAI_API_KEY"],
+        base_url=st.secrets.get("OPENAI_BASE_URL"),
+    )
+
+def generate_sql_with_gpt(user_question):
+    try:
+        return generate_sql(get_openai_client(), user_question)
     except Exception as e:
         st.error(f"Error calling OpenAI API: {e}")
         return None
 
+# ---------- BATCH QUESTIONS ----------
+
+def run_batch_upload(uploaded):
+    """Answer an uploaded question file and keep the zipped report in the session."""
+    import tempfile
+
+    from batch import read_questions, run_batch, zip_report
+
+    questions = read_questions(uploaded.getvalue().decode("utf-8-sig"))
+    if not questions:
+        st.warning("No questions found in the file.")
+        return
+    bar = st.progress(0.0, text=f"0 / {len(questions)} questions")
+
+    def progress(done, total, result):
+        bar.progress(done / total, text=f"{done} / {total} questions")
+
+    with tempfile.TemporaryDirectory(prefix="batch-") as out_dir:
+        try:
+            # Batch queries queue with interactive ones, as this session.
+            controller = get_admission_controller()
+            results, summary = run_batch(
+                questions,
+                out_dir,
+                get_openai_client(),
+                get_db_url(),
+                db_workers=controller.max_per_session,
+                progress=progress,
+                controller=controller,
+                session_id=_session_id(),
+            )
+        except Exception as e:
+            st.error(f"Batch failed: {e}")
+            return
+        st.session_state.batch_report = {
+            "summary": summary,
+            "results": [
+                {"#": r["index"], "question": r["question"], "status": r["status"], "rows": r["rows"]}
+                for r in results
+            ],
+            "zip": zip_report(out_dir),
+            "name": f"{Path(uploaded.name).stem}-report.zip",
+        }
+
+def batch_panel():
+    with st.expander("📦 Batch questions"):
+        st.caption("Upload a .txt file with one question per line; lines starting with # are skipped.")
+        uploaded = st.file_uploader("Question file", type=["txt"], key="batch_file")
+        if st.button("Run batch", disabled=uploaded is None, use_container_width=True):
+            run_batch_upload(uploaded)
+
+        report = st.session_state.get("batch_report")
+        if report:
+            summary = report["summary"]
+            st.caption(
+                f"{summary['ok']}/{summary['questions']} ok, {summary['rejected']} rejected, "
+                f"{summary['failed']} failed in {summary['elapsed_s']:.1f}s"
+            )
+            st.dataframe(report["results"], hide_index=True, use_container_width=True)
+            st.download_button(
+                "⬇️ Download report",
+                report["zip"],
+                file_name=report["name"],
+                mime="application/zip",
+                use_container_width=True,
+            )
+
+# ---------- PROFILING ----------
+
+PROFILED_FUNCTIONS = ("main", "run_query", "generate_sql_with_gpt", "extract_sql_from_response")
+
+def profiling_enabled():
+    """Profile every rerun via the PROFILE_RERUNS secret, or per browser with ?profile=<PROFILE_TOKEN>."""
+    if st.secrets.get("PROFILE_RERUNS", False):
+        return True
+    token = st.secrets.get("PROFILE_TOKEN")
+    supplied = st.query_params.get("profile")
+    return bool(token and supplied) and auth.secrets_match(supplied, token)
+
+def run_profiled(script):
+    """Run one rerun of ``script`` under the profiler and show the result in the sidebar.
+
+    Reruns that end without a signed-in session (the login screen, a logout)
+    are neither saved nor shown, so visitors never see the panel or downloads.
+    """
+    from profiler import RerunProfiler
+
+    st.session_state.profiled_reruns = st.session_state.get("profiled_reruns", 0) + 1
+    name = f"rerun-{time.strftime('%Y%m%d-%H%M%S')}-{_session_id()[:8]}-{st.session_state.profiled_reruns:04d}"
+    profiler = RerunProfiler(name)
+    try:
+        with profiler:
+            script()
+    finally:
+        if st.session_state.get("logged_in"):
+            speedscope_path, collapsed_path = profiler.save()
+            render_profile_panel(profiler, speedscope_path, collapsed_path)
+
+
+def render_profile_panel(profiler, speedscope_path, collapsed_path):
+    summary = profiler.summary()
+    by_name = {row["function"]: row for row in summary}
+    with st.sidebar.expander("🔬 Rerun profile", expanded=True):
+        st.caption(f"{profiler.duration_ms:,.0f} ms under the profiler · saved to {speedscope_path.parent}/")
+        st.dataframe(
+            [by_name.get(name, {"function": name, "calls": 0, "total_ms": 0.0, "self_ms": 0.0}) for name in PROFILED_FUNCTIONS],
+            hide_index=True,
+            use_container_width=True,
+        )
+        st.caption("Top functions by self time")
+        st.dataframe(
+            sorted(summary, key=lambda row: row["self_ms"], reverse=True)[:15],
+            hide_index=True,
+            use_container_width=True,
+        )
+        st.download_button(
+            "⬇️ speedscope.json",
+            speedscope_path.read_bytes(),
+            file_name=speedscope_path.name,
+            mime="application/json",
+            on_click="ignore",
+            use_container_width=True,
+        )
+        st.download_button(
+            "⬇️ Collapsed stacks",
+            collapsed_path.read_bytes(),
+            file_name=collapsed_path.name,
+            mime="text/plain",
+            on_click="ignore",
+            use_container_width=True,
+        )
+
 # ---------- MAIN APP ----------
 
 def main():
+    inject_styles()
     require_login()
 
     # Top bar
@@ -565,17 +1064,21 @@ def main():
         )
         st.divider()
         st.info("Tip: keep scope tight (e.g., top 20, last 90 days) for faster results.")
+        batch_panel()
         if st.button("Logout"):
+            # The token may live on in browser history or a shared link.
+            get_revoked_tokens().revoke(st.session_state.pop("session_token", None))
             st.session_state.logged_in = False
+            st.query_params.pop("session", None)
             st.rerun()
 
     # State
-    if "query_history" not in st.session_state:
-        st.session_state.query_history = []
     if "generated_sql" not in st.session_state:
         st.session_state.generated_sql = None
     if "current_question" not in st.session_state:
         st.session_state.current_question = None
+    if "last_result" not in st.session_state:
+        st.session_state.last_result = None
 
     # Workspace
     st.markdown("<div class='workspace'>", unsafe_allow_html=True)
@@ -610,9 +1113,9 @@ def main():
             st.markdown("</div>", unsafe_allow_html=True)
 
         if clear_button:
-            st.session_state.query_history = []
             st.session_state.generated_sql = None
             st.session_state.current_question = None
+            st.session_state.last_result = None
 
         if generate_button and user_question:
             question = user_question.strip()
@@ -621,10 +1124,12 @@ def main():
                 st.session_state.current_question = None
 
             with st.spinner("🧠 Composing SQL…"):
+                started_at = time.perf_counter()
                 sql_query = generate_sql_with_gpt(question)
                 if sql_query:
                     st.session_state.generated_sql = sql_query
                     st.session_state.current_question = question
+                    st.session_state.generate_ms = (time.perf_counter() - started_at) * 1000
 
         if st.session_state.generated_sql:
             st.markdown("---")
@@ -637,25 +1142,49 @@ def main():
                 height=220,
             )
 
-            st.markdown("<div class='btn-primary'>", unsafe_allow_html=True)
-            run_button = st.button(
-                "▶️ Run query", use_container_width=True, key="run_btn"
-            )
-            st.markdown("</div>", unsafe_allow_html=True)
+            run_cols = st.columns([1, 2])
+            with run_cols[0]:
+                st.markdown("<div class='btn-primary'>", unsafe_allow_html=True)
+                run_button = st.button(
+                    "▶️ Run query", use_container_width=True, key="run_btn"
+                )
+                st.markdown("</div>", unsafe_allow_html=True)
+            with run_cols[1]:
+                preview_mode = st.toggle(
+                    "⚡ Fast preview for aggregates",
+                    key="preview_mode",
+                    help="Estimate SUM/COUNT queries from a sample of OrderDetail first, then swap in exact results.",
+                )
 
             if run_button:
                 with st.spinner("Running against warehouse…"):
-                    df = run_query(edited_sql)
-                    if df is not None:
-                        st.session_state.query_history.append(
-                            {
-                                "question": st.session_state.current_question,
-                                "sql": edited_sql,
-                                "rows": len(df),
-                            }
+                    started_at = time.perf_counter()
+                    started = start_preview(edited_sql) if preview_mode else None
+                    if started is not None:
+                        df, plan, future = started
+                        st.session_state.last_result = make_result(
+                            df,
+                            edited_sql,
+                            preview_percent=plan.percent,
+                            refinement=future,
+                        )
+                    else:
+                        df = run_query(edited_sql)
+                        st.session_state.last_result = (
+                            make_result(df, edited_sql) if df is not None else None
                         )
-                        st.success(f"✅ Query returned {len(df)} rows")
-                        st.dataframe(df, use_container_width=True)
+                    if st.session_state.last_result is not None:
+                        record_history(
+                            st.session_state.last_result,
+                            st.session_state.current_question,
+                            # Only the first run of generated SQL paid for the LLM call.
+                            st.session_state.pop("generate_ms", None),
+                            (time.perf_counter() - started_at) * 1000,
+                        )
+                    st.session_state.pop("result_page", None)
+
+            if st.session_state.last_result is not None:
+                render_last_result()
 
     with right:
         st.markdown("<div class='section-title'>Workspace stats</div>", unsafe_allow_html=True)
@@ -671,6 +1200,9 @@ def main():
                 unsafe_allow_html=True,
             )
 
+        load = get_admission_controller().snapshot()
+        st.caption(f"Warehouse queue: {load['running']} running · {load['waiting']} waiting")
+
         st.markdown("<div class='section-title' style='margin-top:0.6rem;'>Schema primer</div>", unsafe_allow_html=True)
         st.markdown(
             "<div class='section-caption'>Use these anchors when you phrase your question.</div>",
@@ -681,17 +1213,13 @@ def main():
             language="text",
         )
 
-        if st.session_state.query_history:
-            st.markdown("<div class='section-title' style='margin-top:0.6rem;'>Recent queries</div>", unsafe_allow_html=True)
-            for idx, item in enumerate(reversed(st.session_state.query_history[-3:])):
-                st.markdown(
-                    f"**Q{len(st.session_state.query_history)-idx}:** {item['question']}"
-                )
-                st.code(item["sql"], language="sql")
-                st.caption(f"Rows: {item['rows']}")
+        history_panel()
 
     st.markdown("</div>", unsafe_allow_html=True)
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    if profiling_enabled():
+        run_profiled(main)
+    else:
+        main()
\ No newline at end of file
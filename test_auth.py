@@ -0,0 +1,30 @@
+import auth
+
+SECRET = b"test-secret"
+
+
+def test_session_token_round_trip():
+    token = auth.issue_session_token(SECRET)
+
+    assert auth.verify_session_token(token, SECRET)
+    assert not auth.verify_session_token(token, b"other-secret")
+
+
+def test_non_ascii_token_is_refused():
+    assert not auth.verify_session_token("1.a.é", SECRET)
+    assert not auth.verify_session_token("9999999999.nonce.sïgnature", SECRET)
+
+
+def test_revoked_token_is_refused_in_any_spelling():
+    token = auth.issue_session_token(SECRET)
+    revoked = auth.RevokedTokens()
+    revoked.revoke(token)
+
+    assert not auth.verify_session_token(token, SECRET, revoked)
+    assert not auth.verify_session_token("+" + token, SECRET, revoked)
+    assert not auth.verify_session_token("0" + token, SECRET, revoked)
+
+
+def test_secrets_match():
+    assert auth.secrets_match("é", "é")
+    assert not auth.secrets_match("é", "e")
@@ -1,5 +1,23 @@
+import argparse
+import json
+import statistics
+import time
+
 import psycopg2
-from utils import get_db_url
+
+from benchmark_copy import build_orderdetail_buffer
+from populate_db import EXPECTED_COLUMNS, STAGE_BATCH_ROWS, CopyBuffer, copy_rows_binary, copy_rows_text
+from utils import get_db_url, get_replica_urls
+
+SERVER_SETTINGS = [
+    "server_version",
+    "max_connections",
+    "superuser_reserved_connections",
+    "shared_buffers",
+    "work_mem",
+    "maintenance_work_mem",
+    "effective_cache_size",
+]
 
 
 def test_postgress_connection(connection_string):
@@ -22,6 +40,240 @@ def test_postgress_connection(connection_string):
         print(e)
         return False
 
-DATABASE_URL = get_db_url()
 
-test_postgress_connection(DATABASE_URL)
\ No newline at end of file
+def _summary(samples):
+    ordered = sorted(samples)
+    return {
+        "min_ms": ordered[0] * 1000,
+        "p50_ms": statistics.median(ordered) * 1000,
+        "p95_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000,
+        "max_ms": ordered[-1] * 1000,
+    }
+
+
+def measure_connect(connection_string, iterations):
+    """Time full connection setup (TCP, TLS and authentication)."""
+    samples = []
+    ssl_in_use = None
+    for _ in range(iterations):
+        start = time.perf_counter()
+        conn = psycopg2.connect(connection_string)
+        samples.append(time.perf_counter() - start)
+        ssl_in_use = conn.info.ssl_in_use
+        conn.close()
+    return {**_summary(samples), "ssl": ssl_in_use}
+
+
+def measure_round_trip(conn, iterations):
+    samples = []
+    with conn.cursor() as cur:
+        for _ in range(iterations):
+            start = time.perf_counter()
+            cur.execute("SELECT 1")
+            cur.fetchone()
+            samples.append(time.perf_counter() - start)
+    return _summary(samples)
+
+
+def measure_copy_in(conn, rows):
+    buffer = build_orderdetail_buffer(rows)
+    with conn.cursor() as cur:
+        cur.execute("""
+            CREATE TEMP TABLE IF NOT EXISTS probe_orderdetail (
+                CustomerID INTEGER NOT NULL,
+                ProductID INTEGER NOT NULL,
+                OrderDate DATE NOT NULL,
+                QuantityOrdered INTEGER NOT NULL
+            )
+        """)
+        cur.execute("TRUNCATE probe_orderdetail")
+    conn.commit()
+    start = time.perf_counter()
+    payload = copy_rows_binary(conn, "probe_orderdetail", buffer)
+    elapsed = time.perf_counter() - start
+    return {
+        "rows": rows,
+        "seconds": elapsed,
+        "rows_per_s": rows / elapsed,
+        "mb_per_s": payload / elapsed / 1e6,
+        "bytes_per_row": payload / rows,
+    }
+
+
+def build_stage_buffer(rows):
+    """Text rows shaped like ``data.csv`` records, as populate_db stages them."""
+    buffer = CopyBuffer([(column, "text") for column in EXPECTED_COLUMNS["data"]])
+    for i in range(rows):
+        buffer.append((
+            f"Customer {i}",
+            f"{i % 9000 + 1} Market Street",
+            f"City {i % 700}",
+            f"Country {i % 90}",
+            f"Region {i % 9}",
+            f"Product {i % 500}",
+        ))
+    return buffer
+
+
+def measure_stage_copy_in(conn, rows, batch_rows=STAGE_BATCH_ROWS):
+    """Time the staging path: text COPY, one committed batch at a time."""
+    buffer = build_stage_buffer(rows)
+    columns = ", ".join(f"{column} TEXT" for column in buffer.columns)
+    with conn.cursor() as cur:
+        cur.execute(f"CREATE TEMP TABLE IF NOT EXISTS probe_stage ({columns})")
+        cur.execute("TRUNCATE probe_stage")
+    conn.commit()
+    batch = CopyBuffer([(column, "text") for column in buffer.columns])
+    payload = 0
+    start = time.perf_counter()
+    for offset in range(0, rows, batch_rows):
+        batch.data = [values[offset:offset + batch_rows] for values in buffer.data]
+        payload += copy_rows_text(conn, "probe_stage", batch)
+    elapsed = time.perf_counter() - start
+    return {
+        "rows": rows,
+        "seconds": elapsed,
+        "rows_per_s": rows / elapsed,
+        "mb_per_s": payload / elapsed / 1e6,
+        "bytes_per_row": payload / rows,
+    }
+
+
+class _CountingSink:
+    def __init__(self):
+        self.bytes = 0
+
+    def write(self, data):
+        self.bytes += len(data)
+
+
+def measure_copy_out(conn, rows):
+    sink = _CountingSink()
+    sql = (
+        "COPY (SELECT g, g % 500, DATE '2024-01-01' + (g % 365), g % 10 "
+        f"FROM generate_series(1, {int(rows)}) g) TO STDOUT WITH (FORMAT binary)"
+    )
+    start = time.perf_counter()
+    with conn.cursor() as cur:
+        cur.copy_expert(sql, sink, size=1 << 20)
+    elapsed = time.perf_counter() - start
+    conn.commit()
+    return {
+        "rows": rows,
+        "seconds": elapsed,
+        "rows_per_s": rows / elapsed,
+        "mb_per_s": sink.bytes / elapsed / 1e6,
+    }
+
+
+def read_server_settings(conn):
+    with conn.cursor() as cur:
+        settings = {}
+        for name in SERVER_SETTINGS:
+            cur.execute("SELECT current_setting(%s, true)", (name,))
+            settings[name] = cur.fetchone()[0]
+    conn.commit()
+    return settings
+
+
+def _round_batch(rows):
+    for step in (100_000, 10_000, 1_000):
+        if rows >= step:
+            return int(rows // step * step)
+    return 1_000
+
+
+def recommend(round_trip, stage_copy_in, settings):
+    """Derive the environment settings for populate_db staging and the app's query pool."""
+    rtt_s = round_trip["p50_ms"] / 1000
+    # Size staging batches so the commit round trip is at most ~5% of the
+    # time spent streaming that batch. A batch the database refuses is
+    # retried row by row, so stay well below the largest COPY.
+    stage_batch_rows = _round_batch(min(50_000, max(1_000, 19 * rtt_s * stage_copy_in["rows_per_s"])))
+    # Keep each COPY chunk around 4 MB on the wire.
+    copy_chunk_rows = _round_batch(min(500_000, max(1_000, 4e6 / stage_copy_in["bytes_per_row"])))
+
+    max_connections = int(settings["max_connections"])
+    reserved = int(settings["superuser_reserved_connections"] or 3)
+    # Give an app instance a quarter of the slots, leaving the rest for
+    # populate_db workers, admin sessions and other instances. It holds a
+    # query pool and a preview pool of this size plus two planner connections.
+    max_running = max(1, min(16, ((max_connections - reserved) // 4 - 2) // 2))
+    return {
+        "DB_STAGE_BATCH_ROWS": stage_batch_rows,
+        "DB_COPY_CHUNK_ROWS": copy_chunk_rows,
+        "ADMISSION_MAX_RUNNING": max_running,
+    }
+
+
+def run_probe(connection_string, iterations=50, copy_rows=200_000):
+    report = {"connect": measure_connect(connection_string, max(3, iterations // 10))}
+    conn = psycopg2.connect(connection_string)
+    try:
+        report["round_trip"] = measure_round_trip(conn, iterations)
+        report["copy_in"] = measure_copy_in(conn, copy_rows)
+        report["stage_copy_in"] = measure_stage_copy_in(conn, copy_rows)
+        report["copy_out"] = measure_copy_out(conn, copy_rows)
+        report["settings"] = read_server_settings(conn)
+    finally:
+        conn.close()
+    report["recommendations"] = recommend(report["round_trip"], report["stage_copy_in"], report["settings"])
+    return report
+
+
+def probe_replicas(replica_urls):
+    from replicas import ReplicaRouter
+
+    return ReplicaRouter(replica_urls).status()
+
+
+def print_report(report):
+    c = report["connect"]
+    print(f"Connect (TCP+TLS+auth, ssl={c['ssl']}): p50 {c['p50_ms']:.1f} ms, p95 {c['p95_ms']:.1f} ms")
+    r = report["round_trip"]
+    print(f"Statement round trip: min {r['min_ms']:.2f} ms, p50 {r['p50_ms']:.2f} ms, p95 {r['p95_ms']:.2f} ms")
+    for direction in ("copy_in", "stage_copy_in", "copy_out"):
+        t = report[direction]
+        print(f"{direction.replace('_', ' ').upper():<13} {t['rows']:,} rows: {t['rows_per_s']:,.0f} rows/s, {t['mb_per_s']:.1f} MB/s")
+    print("Server settings:")
+    for name, value in report["settings"].items():
+        print(f"  {name:<32} {value}")
+    print("Recommended environment:")
+    for name, value in report["recommendations"].items():
+        print(f"  {name}={value}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Probe connection latency and throughput to the database.")
+    parser.add_argument("--iterations", type=int, default=50, help="Round trips to time.")
+    parser.add_argument("--copy-rows", type=int, default=200_000, help="Rows per COPY direction.")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON.")
+    parser.add_argument("--quick", action="store_true", help="Only check that a connection can be made.")
+    parser.add_argument(
+        "--replicas",
+        action="store_true",
+        help="Report health, replay lag and load of POSTGRES_REPLICA_URLS.",
+    )
+    args = parser.parse_args()
+
+    DATABASE_URL = get_db_url()
+
+    if args.quick:
+        test_postgress_connection(DATABASE_URL)
+    elif args.replicas:
+        status = probe_replicas(get_replica_urls())
+        if args.json:
+            print(json.dumps(status, indent=2))
+        else:
+            for replica in status:
+                lag = "n/a" if replica["lag_s"] is None else f"{replica['lag_s']:.1f}s"
+                print(
+                    f"{replica['replica']:<28} healthy={replica['healthy']!s:<5} lag={lag:<8} "
+                    f"active={replica['active']}  {replica['reason']}"
+                )
+    else:
+        report = run_probe(DATABASE_URL, args.iterations, args.copy_rows)
+        if args.json:
+            print(json.dumps(report, indent=2))
+        else:
+            print_report(report)
@@ -0,0 +1,23 @@
+import pandas as pd
+
+from results import compact_frame, to_arrow
+
+
+def test_to_arrow_shows_mixed_object_columns_as_text():
+    df = pd.DataFrame({
+        "id": [1, 2, 3],
+        "payload": [{"a": 1}, [1, 2], 3],
+        "name": ["x", "y", None],
+    })
+
+    table = to_arrow(compact_frame(df))
+
+    assert table.column("payload").to_pylist() == ["{'a': 1}", "[1, 2]", "3"]
+    assert table.column("id").to_pylist() == [1, 2, 3]
+    assert table.column("name").to_pylist() == ["x", "y", None]
+
+
+def test_to_arrow_suffixes_duplicate_column_names():
+    df = pd.DataFrame([[1, 2]], columns=["count", "count"])
+
+    assert to_arrow(df).column_names == ["count", "count_2"]
@@ -0,0 +1,40 @@
+import csv
+import io
+
+from validation import LineCounter, validated_rows
+
+COLUMNS = ["Name", "City"]
+
+
+class CollectedRejects:
+    def __init__(self):
+        self.seen = 0
+        self.rejected = []
+
+    def add(self, line, reason, fields):
+        self.rejected.append((line, reason, fields))
+
+
+def _validate(text):
+    lines = LineCounter(io.StringIO(text))
+    reader = csv.DictReader(lines, delimiter="\t")
+    assert reader.fieldnames == COLUMNS
+    rejects = CollectedRejects()
+    rows = list(validated_rows(reader, lines, COLUMNS, ["Name"], rejects))
+    return rows, rejects
+
+
+def test_blank_lines_are_not_part_of_the_next_record():
+    rows, rejects = _validate("Name\tCity\nAda\tLondon\n\n\tParis\n\r\nBob\tOslo\n")
+
+    assert rows == [(2, ["Ada", "London"]), (6, ["Bob", "Oslo"])]
+    assert rejects.rejected == [(4, "Name empty", ["", "Paris"])]
+    assert rejects.seen == 3
+
+
+def test_stray_quote_rejects_one_line_and_rereads_the_rest():
+    rows, rejects = _validate('Name\tCity\n"Ada\tLondon\nBob\tOslo\nCy\tRome\n')
+
+    assert rows == [(3, ["Bob", "Oslo"]), (4, ["Cy", "Rome"])]
+    assert [line for line, _, _ in rejects.rejected] == [2]
+    assert rejects.seen == 3
@@ -1,4 +1,5 @@
 import os
+from urllib.parse import quote, urlencode
 from dotenv import load_dotenv
 
 
@@ -6,7 +7,13 @@ load_dotenv()  # reads variables from a .env file and sets them in os.environ
 
 
 
-def get_db_url():
+def get_db_url(connect_timeout=None, **settings):
+    """Build the database URL from the environment.
+
+    Any keyword ``settings`` (e.g. ``statement_timeout="300s"``) are passed as
+    libpq ``options`` so the server applies them at connection startup rather
+    than needing separate ``SET`` round trips.
+    """
     POSTGRES_USERNAME = os.environ["POSTGRES_USERNAME"]
     POSTGRES_PASSWORD = os.environ["POSTGRES_PASSWORD"]
     POSTGRES_SERVER = os.environ["POSTGRES_SERVER"]
@@ -14,4 +21,34 @@ def get_db_url():
 
     DATABASE_URL = f"postgresql://{POSTGRES_USERNAME}:{POSTGRES_PASSWORD}@{POSTGRES_SERVER}/{POSTGRES_DATABASE}"
 
-    return DATABASE_URL
+    return with_session_options(DATABASE_URL, connect_timeout, **settings)
+
+
+def get_replica_urls(connect_timeout=None, **settings):
+    """Read-replica URLs from the comma-separated ``POSTGRES_REPLICA_URLS``.
+
+    Takes the same arguments as ``get_db_url``; returns an empty list when no
+    replicas are configured.
+    """
+    urls = [url.strip() for url in os.getenv("POSTGRES_REPLICA_URLS", "").split(",") if url.strip()]
+    return [with_session_options(url, connect_timeout, **settings) for url in urls]
+
+
+def with_session_options(url, connect_timeout=None, **settings):
+    """Append ``connect_timeout`` and libpq ``options`` for ``settings`` to ``url``."""
+    params = {}
+    if connect_timeout is not None:
+        params["connect_timeout"] = connect_timeout
+    if settings:
+        params["options"] = " ".join(
+            f"-c {name}={_escape_option(value)}" for name, value in settings.items()
+        )
+    if not params:
+        return url
+    separator = "&" if "?" in url else "?"
+    return url + separator + urlencode(params, quote_via=quote)
+
+
+def _escape_option(value):
+    # libpq splits ``options`` on whitespace; backslash-escape to keep values whole.
+    return str(value).replace("\\", "\\\\").replace(" ", "\\ ")
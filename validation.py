@@ -0,0 +1,210 @@
+"""Streaming validation for the staging loader.
+
+``validated_rows`` sits between the CSV reader and the inserts: good records
+stream through, bad ones are handed to ``Rejects`` with their line number and
+reason. ``Rejects`` writes them to a TSV file and the ``stage_reject``
+quarantine table, and stops the load once the error budget is spent.
+"""
+import csv
+import os
+from pathlib import Path
+
+from psycopg2 import extras
+
+MAX_FIELD_CHARS = int(os.getenv("DB_MAX_FIELD_CHARS", "1000"))
+MAX_REJECTS = int(os.getenv("DB_MAX_REJECTS", "1000"))
+MAX_REJECT_RATIO = float(os.getenv("DB_MAX_REJECT_RATIO", "0.05"))
+REJECTS_DIR = Path(os.getenv("DB_REJECTS_DIR", "rejects"))
+
+
+def _has_bad_bytes(value):
+    # Undecodable bytes arrive as lone surrogates (errors="surrogateescape").
+    return any("\udc80" <= ch <= "\udcff" for ch in value)
+
+
+def _printable(value):
+    """``value`` made safe for a UTF-8 file and a TEXT column."""
+    if value is None:
+        return ""
+    return value.encode("utf-8", "surrogateescape").decode("utf-8", "replace").replace("\x00", "\\x00")
+
+
+def check_row(row, expected_columns, required, max_chars=MAX_FIELD_CHARS):
+    """Reasons ``row`` (a ``csv.DictReader`` record) cannot be staged; empty if none."""
+    problems = []
+    if row.get(None):
+        problems.append(f"{len(row[None])} extra field(s)")
+    for column in expected_columns:
+        value = row.get(column)
+        if value is None:
+            problems.append(f"{column} missing")
+            continue
+        if column in required and not value.strip():
+            problems.append(f"{column} empty")
+        if _has_bad_bytes(value):
+            problems.append(f"{column} is not valid UTF-8")
+        if "\x00" in value:
+            problems.append(f"{column} contains NUL")
+        if len(value) > max_chars:
+            problems.append(f"{column} longer than {max_chars} characters")
+    return problems
+
+
+def raw_fields(row, fieldnames):
+    return [row.get(name) for name in fieldnames] + list(row.get(None) or [])
+
+
+class LineCounter:
+    """Iterate over ``lines`` counting them; ``csv`` loses count when a record fails.
+
+    The lines of the current record are kept so that ``resync`` can hand
+    all but the first back to the reader. Blank lines before a record are
+    not part of it: ``csv`` skips them without returning a row.
+    """
+
+    def __init__(self, lines):
+        self.lines = iter(lines)
+        self.count = 0
+        self._before = 0
+        self._record = []
+        self._replay = []
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        line = self._replay.pop() if self._replay else next(self.lines)
+        self.count += 1
+        if not self._record and not line.strip("\r\n"):
+            self._before = self.count
+        else:
+            self._record.append(line)
+        return line
+
+    def mark(self):
+        """Start of the next record."""
+        self._before = self.count
+        self._record = []
+
+    @property
+    def start(self):
+        """Line number of the current record's first line."""
+        return self._before + 1
+
+    def resync(self):
+        """Give up on the current record after its first line; returns that line.
+
+        The lines it swallowed are read again, so a stray quote costs one
+        line instead of every record up to the point where csv gave up.
+        """
+        if not self._record:
+            return ""
+        first, rest = self._record[0], self._record[1:]
+        self.count -= len(rest)
+        self._replay.extend(reversed(rest))
+        self._record = []
+        return first.rstrip("\r\n")
+
+
+def validated_rows(reader, lines, expected_columns, required, rejects, max_chars=MAX_FIELD_CHARS):
+    """Yield ``(line_number, values)`` for every record that passes ``check_row``.
+
+    ``reader`` is a ``csv.DictReader`` over the ``LineCounter`` ``lines``.
+    Line numbers are those of the first physical line of each record.
+    A record that cannot be parsed (e.g. a field over the csv field-size
+    limit), or that fails validation after spanning several lines, is
+    usually an unterminated quote: only its first line is rejected and the
+    lines after it are parsed again.
+    """
+    while True:
+        lines.mark()
+        try:
+            row = next(reader)
+        except StopIteration:
+            return
+        except csv.Error as e:
+            rejects.seen += 1
+            start, end = lines.start, lines.count
+            rejects.add(start, f"unparseable through line {end} ({e}); re-reading from line {start + 1}", [lines.resync()])
+            continue
+        rejects.seen += 1
+        start = lines.start
+        problems = check_row(row, expected_columns, required, max_chars)
+        if problems and lines.count > start:
+            end = lines.count
+            reason = f"{'; '.join(problems)} in a record spanning lines {start}-{end}; re-reading from line {start + 1}"
+            rejects.add(start, reason, [lines.resync()])
+        elif problems:
+            rejects.add(start, "; ".join(problems), raw_fields(row, reader.fieldnames))
+        else:
+            yield start, [row[column] for column in expected_columns]
+
+
+class Rejects:
+    """Rejected records for one input file, within an error budget.
+
+    Records are buffered and written to ``stage_reject`` by ``flush``, which
+    the loader calls just before each commit so quarantine rows land in the
+    same transaction as the batch they were split from. More than
+    ``max_rejects`` rejects, or more than ``max_ratio`` of the records read,
+    raises ``ValueError``.
+    """
+
+    def __init__(self, conn, source, max_rejects=MAX_REJECTS, max_ratio=MAX_REJECT_RATIO, directory=REJECTS_DIR):
+        self.conn = conn
+        self.source = str(source)
+        self.path = Path(directory) / f"{Path(source).name}.rejects.tsv"
+        self.max_rejects = max_rejects
+        self.max_ratio = max_ratio
+        self.count = 0
+        self.seen = 0
+        self._pending = []
+        self._file = None
+        self._writer = None
+        self.path.unlink(missing_ok=True)
+        with conn.cursor() as cur:
+            cur.execute("DELETE FROM stage_reject WHERE Source = %s", (self.source,))
+
+    def add(self, line, reason, fields):
+        fields = [_printable(value) for value in fields]
+        if self._writer is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._file = self.path.open("w", encoding="utf-8", newline="")
+            self._writer = csv.writer(self._file, delimiter="\t")
+            self._writer.writerow(["line", "reason", "fields..."])
+        self._writer.writerow([line, reason, *fields])
+        self._pending.append((self.source, line, reason, "\t".join(fields)))
+        self.count += 1
+        if self.count > self.max_rejects:
+            self._over_budget(f"more than {self.max_rejects} rejected records (last: line {line}, {reason})")
+
+    def flush(self, cursor):
+        if self._pending:
+            extras.execute_values(
+                cursor,
+                "INSERT INTO stage_reject (Source, LineNumber, Reason, RawRecord) VALUES %s",
+                self._pending,
+            )
+            self._pending = []
+        if self._file is not None:
+            self._file.flush()
+
+    def check_ratio(self):
+        if self.seen and self.count > self.max_ratio * self.seen:
+            self._over_budget(
+                f"{self.count:,} of {self.seen:,} records rejected, over the {self.max_ratio * 100:g}% budget"
+            )
+
+    def _over_budget(self, message):
+        # Drop the unfinished batch but keep every reject seen so far.
+        self.conn.rollback()
+        with self.conn.cursor() as cur:
+            self.flush(cur)
+        self.conn.commit()
+        self.close()
+        raise ValueError(f"{self.source}: {message}; see {self.path} and stage_reject")
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = self._writer = None